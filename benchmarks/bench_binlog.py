@@ -0,0 +1,50 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+"""
+Time the output routines writing formatted text, structured records (jsonl), and the binary log,
+each to a destination which discards the data.
+
+Run with:
+    PYTHONPATH=src python3 benchmarks/bench_binlog.py
+"""
+
+import os
+import sys
+import timeit
+
+from eyeo import eo, msg, warn, output_add, output_pop
+from eyeo.sinks import Sink
+from eyeo.structured import RecordSink
+from eyeo.binlog import BinlogSink
+
+class Discard(Sink):
+    """ a destination which throws the output away """
+    def write(self, text):
+        return len(text)
+
+CALLS = {
+    "eo format":    lambda: eo("request {} took {} ms, status {}", 1234, 56.78, "ok"),
+    "eo items":     lambda: eo("request", 1234, "took", 56.78),
+    "msg":          lambda: msg("request", 1234, "took", 56.78, "status", "ok"),
+    "warn record":  lambda: warn("retrying", "host.example.com", 3, [1, 2, 3]),
+}
+
+DESTINATIONS = {
+    "text":     Discard,
+    "jsonl":    lambda: RecordSink(Discard(), "jsonl"),
+    "binlog":   lambda: BinlogSink(Discard(), buffer_size=1 << 20),
+}
+
+def main():
+    number = int(os.environ.get("BENCH_NUMBER", "20000"))
+    for label, call in CALLS.items():
+        for name, make in DESTINATIONS.items():
+            output_add(make())
+            try:
+                elapsed = min(timeit.repeat(call, number=number, repeat=3)) / number
+            finally:
+                output_pop()
+            print(f"{label:<14} {name:<8} {elapsed * 1e6:10.3f} us", file=sys.stdout)
+
+if __name__ == "__main__":
+    main()
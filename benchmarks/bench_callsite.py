@@ -0,0 +1,50 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+"""
+Compare the per-call cost of resolving the dbgmsg() call site with inspect.stack()
+(the previous implementation) against the cached frame lookup.
+
+Run with:
+    PYTHONPATH=src python3 benchmarks/bench_callsite.py
+"""
+
+import os
+import sys
+import inspect
+import timeit
+
+import eyeo
+from eyeo import progname, msg
+
+def dbgmsg_inspect(*args):
+    """ the previous dbgmsg() implementation, kept here as the reference for comparison """
+    if eyeo.Globals.DEBUG:
+        caller = inspect.stack()[1]
+        func = caller.function
+        line = caller.lineno
+        filename = os.path.basename(caller.filename)
+        prog = progname()
+        text = f"{prog}:{filename}.{func}:{line}:" + " ".join([str(x) for x in args])
+        msg(text)
+
+def nested(depth, func):
+    """ call func from a stack that is depth frames deep, as in a real application """
+    if depth:
+        return nested(depth - 1, func)
+    return func()
+
+def run(label, func, number):
+    elapsed = nested(20, lambda: timeit.timeit(func, number=number))
+    print(f"{label:<24} {elapsed / number * 1e6:10.2f} us/call", file=sys.stdout)
+
+def main():
+    number = int(os.environ.get("BENCH_NUMBER", "2000"))
+    eyeo.set_debug(1)
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        eyeo.output_add(devnull)
+        run("dbgmsg (inspect.stack)", lambda: dbgmsg_inspect("value", 1), number)
+        run("dbgmsg (cached site)", lambda: eyeo.dbgmsg("value", 1), number)
+        eyeo.output_pop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+"""
+Time stringify() on wide and deep synthetic structures.
+
+Run with:
+    PYTHONPATH=src python3 benchmarks/bench_stringify.py
+"""
+
+import os
+import sys
+import random
+import timeit
+
+from eyeo.stringify import stringify
+
+class Node:
+    """ a simple object, converted by stringify via its __dict__ """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name, child=None):
+        self.name = name
+        self.child = child
+
+def shuffled_dict(size):
+    keys = [ f"key{i:06d}" for i in range(size) ]
+    random.Random(1).shuffle(keys)
+    return { k: 1 for k in keys }
+
+def deep_list(depth):
+    v = []
+    for _ in range(depth):
+        v = [v, 1]
+    return v
+
+def deep_dict(depth):
+    v = {}
+    for i in range(depth):
+        v = {"k": v, "i": i}
+    return v
+
+def linked(depth):
+    v = None
+    for i in range(depth):
+        v = Node(f"n{i}", v)
+    return v
+
+CASES = {
+    "wide list (100k ints)":      (lambda: list(range(100000)), (None, -1, -1)),
+    "wide list (100k, 6 shown)":  (lambda: list(range(100000)), (3, 6, 400)),
+    "wide dict (20k keys)":       (lambda: { f"key{i:05d}": i for i in range(20000) }, (None, -1, -1)),
+    "wide dict (200k, 6 shown)":  (lambda: shuffled_dict(200000), (3, 6, 400)),
+    "nested records (2k x 10)":   (lambda: [ { f"f{j}": [j, str(j)] for j in range(10) } for i in range(2000) ], (None, -1, -1)),
+    "deep list (depth 500)":      (lambda: deep_list(500), (None, -1, -1)),
+    "deep list (depth 5000)":     (lambda: deep_list(5000), (None, -1, -1)),
+    "deep dict (depth 5000)":     (lambda: deep_dict(5000), (None, -1, -1)),
+    "linked objects (2000)":      (lambda: linked(2000), (None, -1, -1)),
+}
+
+def main():
+    number = int(os.environ.get("BENCH_NUMBER", "5"))
+    for label, (make, args) in CASES.items():
+        data = make()
+        try:
+            elapsed = min(timeit.repeat(lambda: stringify(data, *args), number=number, repeat=3)) / number
+            print(f"{label:<28} {elapsed * 1e3:10.3f} ms", file=sys.stdout)
+        except RecursionError:
+            print(f"{label:<28} {'RecursionError':>13}", file=sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+"""
+Time yaml rendering of large documents with the pure python yaml.Dumper (which pretty() used
+to use) and the libyaml based yaml.CSafeDumper (which pretty() uses when it is available).
+
+Run with:
+    PYTHONPATH=src python3 benchmarks/bench_yaml.py
+"""
+
+import os
+import sys
+import timeit
+
+import yaml
+
+def records(count):
+    return [ { "id": i, "name": f"item {i}", "tags": ["a", "b", "c"], "score": i * 0.5, "meta": { "ok": True, "parent": None } } for i in range(count) ]
+
+def nested(depth, width):
+    v = { "leaf": list(range(width)) }
+    for i in range(depth):
+        v = { f"level{i}": v, "values": list(range(width)) }
+    return v
+
+CASES = {
+    "records (5k)":             lambda: records(5000),
+    "nested (depth 50 x 100)":  lambda: nested(50, 100),
+}
+
+DUMPERS = {
+    "Dumper":       yaml.Dumper,
+    "SafeDumper":   yaml.SafeDumper,
+    "CSafeDumper":  getattr(yaml, "CSafeDumper", None),
+}
+
+def main():
+    number = int(os.environ.get("BENCH_NUMBER", "3"))
+    for label, make in CASES.items():
+        data = make()
+        for name, dumper in DUMPERS.items():
+            if dumper is None:
+                print(f"{label:<26} {name:<12} {'(no libyaml)':>13}", file=sys.stdout)
+                continue
+            elapsed = min(timeit.repeat(lambda: yaml.dump(data, Dumper=dumper, sort_keys=True, default_flow_style=False, indent=4), number=number, repeat=3)) / number
+            print(f"{label:<26} {name:<12} {elapsed * 1e3:10.3f} ms", file=sys.stdout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+"""
+Benchmark suite for the eyeo hot paths, with JSON baselines for spotting regressions.
+
+Each case is timed with timeit (best of several repeats), and reported as the time per call.
+The output is formatted and written to a destination which discards it, so the cost of
+writing to a terminal or file is not included.
+
+Run with:
+    PYTHONPATH=src python3 benchmarks/run.py                      # print the results
+    PYTHONPATH=src python3 benchmarks/run.py --save baseline.json  # save them as a baseline
+    PYTHONPATH=src python3 benchmarks/run.py --compare baseline.json --threshold 0.25
+
+With --compare, the exit status is 1 if any case is slower than the baseline by more than
+the threshold (a fraction, ie 0.25 allows 25% slower). See also "make bench", where the
+threshold is BENCH_THRESHOLD.
+
+The timings depend on the machine, so a baseline also records the time of a fixed calibration
+loop (pure python, no eyeo), and when comparing, the baseline timings are scaled by how much
+faster or slower the calibration loop is now. That only makes up for the overall speed of the
+machine: a baseline is still best regenerated (with "make bench-baseline") on the machine which
+runs the comparison, and a noisy machine may need a larger threshold.
+No network access or optional packages are needed (the yaml case is skipped without yaml).
+"""
+
+import os
+import re
+import sys
+import json
+import timeit
+import argparse
+import platform
+
+import eyeo
+from eyeo import eo, msg, msgx, verb, dbgmsg, set_verbose, set_debug, output_add, output_pop, output_buffer, os_path_splitall, stringify
+from eyeo.sinks import Sink
+
+# the helper modules are beside this script, wherever it is run from (eg "make bench")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_stringify import deep_list, deep_dict, linked, shuffled_dict # pylint: disable=wrong-import-position
+
+class Discard(Sink):
+    """ a destination which throws the output away, after it has been fully formatted """
+    def write(self, text):
+        return len(text)
+
+RECORD = { "name": "example", "values": [1, 2.5, "three", None], "nested": { "a": 1, "b": [True, False] } }
+WIDE = list(range(100000))
+DEEP = deep_list(2000)
+# built by the case's setup, so that the data is only created when the case is run
+HUGE = None
+LINKED = linked(2000)
+SHUFFLED = shuffled_dict(100000)
+DEEP_DICT = deep_dict(2000)
+
+def _cycle_buffer():
+    output_buffer()
+    eo("captured")
+    output_pop()
+
+def _build_huge():
+    global HUGE # pylint: disable=global-statement
+    if HUGE is None:
+        HUGE = list(range(10000000))
+
+def _gated(verbose, debug):
+    def setup():
+        set_verbose(verbose)
+        set_debug(debug)
+    return setup
+
+# name: (function, number of calls per repeat, setup)
+CASES = {
+    "eo str":                    (lambda: eo("value:", 42, "text"), 20000, None),
+    "eo repr":                   (lambda: eo("value:", 42, "text", style="repr"), 20000, None),
+    "eo stringify":              (lambda: eo(RECORD, style="stringify"), 5000, None),
+    "eo json":                   (lambda: eo(RECORD, style="json"), 2000, None),
+    "eo yaml":                   (lambda: eo(RECORD, style="yaml"), 200, None),
+    "eo format fast path":       (lambda: eo("value {} of {}", 1, 2), 20000, None),
+    "msg":                       (lambda: msg("record", RECORD), 5000, None),
+    "msgx":                      (lambda: msgx(", ", 1, "two", [3]), 10000, None),
+    "msg (rate limited)":        (lambda: msg("retry", RECORD, rate="1/s"), 50000, None),
+    "verb (verbose 0)":          (lambda: verb("value:", RECORD), 50000, _gated(0, 0)),
+    "verb (verbose 1)":          (lambda: verb("value:", RECORD), 5000, _gated(1, 0)),
+    "dbgmsg (debug 0)":          (lambda: dbgmsg("value:", 1), 50000, _gated(0, 0)),
+    "dbgmsg (debug 1)":          (lambda: dbgmsg("value:", 1), 10000, _gated(0, 1)),
+    "stringify wide (100k)":     (lambda: stringify(WIDE), 5, None),
+    "stringify wide (6 shown)":  (lambda: stringify(WIDE, 3, 6, 400), 10000, None),
+    "stringify deep (2000)":     (lambda: stringify(DEEP), 20, None),
+    "stringify huge (10M, msg)": (lambda: stringify(HUGE, 3, 6, 400), 10000, _build_huge),
+    "stringify objects (2000)":  (lambda: stringify(LINKED, None, 6), 20, None),
+    "stringify dict (6 shown)":  (lambda: stringify(SHUFFLED, 3, 6, 400), 5, None),
+    "stringify dict depth 2000": (lambda: stringify(DEEP_DICT), 20, None),
+    "output_buffer/output_pop":  (_cycle_buffer, 20000, None),
+    "os_path_splitall":          (lambda: os_path_splitall("/usr/local/lib/python3/site-packages/eyeo"), 20000, None),
+}
+
+def _calibration_loop():
+    total = 0
+    parts = []
+    for i in range(1000):
+        total += i * i
+        parts.append(str(i))
+    return total, "".join(parts), { p: len(p) for p in parts }
+
+def calibrate(repeat=5):
+    """
+    Time the calibration loop (which doesn't use eyeo), and return the seconds per call.
+    """
+    _calibration_loop()
+    return min(timeit.repeat(_calibration_loop, number=200, repeat=repeat)) / 200
+
+def run_cases(pattern=None, repeat=5, scale=1.0):
+    """
+    Time the cases (those whose name matches the pattern), and return the seconds per call of each.
+    """
+    results = {}
+    output_add(Discard())
+    try:
+        for name, (func, number, setup) in CASES.items():
+            if pattern and not re.search(pattern, name):
+                continue
+            if name == "eo yaml" and eyeo.yaml is eyeo.FakeYaml:
+                # yaml is not installed
+                continue
+            set_verbose(0)
+            set_debug(0)
+            if setup:
+                setup()
+            number = max(1, int(number * scale))
+            func()
+            results[name] = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    finally:
+        set_verbose(0)
+        set_debug(0)
+        eyeo.rate_limit_flush()
+        output_pop()
+    return results
+
+def compare(results, baseline, threshold, speed=1.0):
+    """
+    Print the results against the baseline, and return the names of the cases which regressed.
+
+    Parameters:
+        speed: the time of the calibration loop now, relative to when the baseline was saved
+               (the baseline timings are multiplied by it)
+    """
+    regressed = []
+    if speed != 1.0:
+        print(f"baseline timings scaled by {speed:.3f} (the calibration loop)", file=sys.stdout)
+    print(f"{'case':<28} {'baseline':>12} {'current':>12} {'change':>8}", file=sys.stdout)
+    for name, elapsed in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<28} {'-':>12} {_fmt(elapsed):>12} {'new':>8}", file=sys.stdout)
+            continue
+        base *= speed
+        change = elapsed / base - 1.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        print(f"{name:<28} {_fmt(base):>12} {_fmt(elapsed):>12} {change:+8.1%}{flag}", file=sys.stdout)
+    return regressed
+
+def _fmt(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} ms"
+    return f"{seconds * 1e6:.3f} us"
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the eyeo benchmarks")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results against a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=float(os.environ.get("BENCH_THRESHOLD", "0.25")),
+                        help="the slowdown (as a fraction) allowed before a case is a regression (default 0.25)")
+    parser.add_argument("--filter", metavar="REGEX", help="only run the cases whose names match")
+    parser.add_argument("--repeat", type=int, default=5, help="the number of repeats of each case (the best is used)")
+    parser.add_argument("--scale", type=float, default=float(os.environ.get("BENCH_SCALE", "1.0")),
+                        help="scale the number of calls per repeat (eg 0.1 for a quick run)")
+    args = parser.parse_args()
+
+    results = run_cases(args.filter, args.repeat, args.scale)
+    calibration = calibrate(args.repeat)
+
+    if args.save:
+        data = { "python": platform.python_version(), "machine": platform.machine(),
+                 "calibration": calibration, "results": results }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, sort_keys=True)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        # older baselines have no calibration, and are compared as they are
+        speed = calibration / baseline["calibration"] if baseline.get("calibration") else 1.0
+        regressed = compare(results, baseline["results"], args.threshold, speed)
+        if regressed:
+            print(f"{len(regressed)} case(s) slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressed)}", file=sys.stdout)
+            return 1
+        return 0
+
+    for name, elapsed in results.items():
+        print(f"{name:<28} {_fmt(elapsed):>12}", file=sys.stdout)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name,import-outside-toplevel
 # pylint: disable=too-many-lines
 """
 
@@ -38,39 +38,144 @@ For example:
         eo("This prints to f again")
     output_pop()
     eo("This prints to stderr again")
+
+Besides file handles, the output stack accepts sinks (see eyeo.sinks), such as
+FileSink (block buffered writes), StringSink (capture), DedupSink (collapse repeated
+messages, see output_dedup()) and NullSink (discard, without formatting the output at all):
+
+    output_add(FileSink(sys.stderr, buffer_size=65536, flush_interval=1.0))
+
+asyncio programs can use eyeo.aio, which provides a StreamSink for an asyncio.StreamWriter,
+and aeo() / amsg() coroutines which wait for the destination to drain.
+
+To keep slow destinations (pipes, network filesystems) from stalling the caller,
+output can be queued and written from a background thread:
+
+    output_background(overflow="drop-oldest")
+    eo("This is written by the background thread")
+    output_pop()
+
+## Rate limiting
+
+A call site in a tight loop can be limited, with the dropped messages counted and reported
+as "suppressed N messages from file:line" (when the site prints again, every few seconds while
+it is suppressed, and at exit):
+
+    warn("retrying", url, rate="10/s")
+    set_rate_limit("100/s")     # the default for every call site
+
+## Structured output
+
+For log indexers, each call can be written as one JSON object (JSON Lines) or one logfmt
+line, with the time, level, call site, message and typed arguments as fields (see eyeo.structured):
+
+    output_records("jsonl")
+    warn("retrying", url, 3)
+    eo("count", n, style="logfmt")     # a single call
+
+For the highest rates, output_binlog(path) writes a binary log, where each call is only the id
+of its call site and format string, and its packed arguments, and the text is formatted later
+with "python -m eyeo.binlog path" (see eyeo.binlog).
 """
 
 import os
-import re
 import sys
-import inspect
-import traceback
-import logging
-import json
 import time
+import threading
+import contextvars
 
 from io import StringIO
-from pprint import pformat
 
-from eyeo.stringify import stringify, stringify_value
+from eyeo.stringify import stringify, stringify_value, stringify_to, register_stringifier, ndarray_summary
+from eyeo.stringify import set_stringify_cache, stringify_cache_stats, mark_cacheable
+from eyeo.sinks import Sink, FileSink, StringSink, NullSink, DedupSink, BackgroundWriter
+from eyeo.instrument import Instrument, counter, count_call, count_suppressed, encoded_size, perf_counter_ns
 
 typerepresenters = {}
 
-try:
-    # pylint: disable=import-error
-    # pylint: disable=bare-except
-    import yaml
-except:
-    class FakeYaml:
-        # pylint: disable=too-few-public-methods
-        """ fake yaml class to substitute for missing (optional) yaml module """
-        @classmethod
-        def dumps(cls, data, sort_keys=None, default_flow_style=None, indent=None, default_style=None, line_break=None):
-            # pylint: disable=unused-argument,too-many-arguments
+class FakeYaml:
+    """ fake yaml class to substitute for missing (optional) yaml module """
+    warned = False
+
+    @classmethod
+    def dump(cls, data, stream=None, sort_keys=None, **kwargs):
+        # pylint: disable=unused-argument
+        import json
+        if not cls.warned:
+            cls.warned = True
             msg("Warning - no yaml support - falling back to json format")
-            return json.dumps(data, sort_keys=sort_keys)
+        text = json.dumps(data, sort_keys=bool(sort_keys), indent=kwargs.get('indent'), default=_json_default)
+        if stream is None:
+            return text
+        stream.write(text)
+        return None
 
-    yaml = FakeYaml
+    dumps = dump
+
+def _yaml():
+    """
+    Return the yaml module, which is imported the first time that yaml output is needed,
+    or FakeYaml if it is not installed.
+    """
+    if Globals.yaml is None:
+        try:
+            # pylint: disable=import-outside-toplevel
+            import yaml
+            # the libyaml based dumpers are much faster, if available. They are subclassed, so that
+            # the representers added here do not change the output of other users of yaml
+            def subclassed(safe, full):
+                dumpers = tuple(type("Eyeo" + d.__name__, (d,), {}) for d in (safe, full))
+                # tuples are shown as the full dumper shows them, rather than as lists
+                dumpers[0].add_representer(tuple, yaml.Dumper.represent_tuple)
+                return dumpers
+            Globals.yaml_dumpers = subclassed(getattr(yaml, 'CSafeDumper', yaml.SafeDumper), getattr(yaml, 'CDumper', yaml.Dumper))
+            Globals.yaml_scalar_dumpers = subclassed(yaml.SafeDumper, yaml.Dumper)
+            Globals.yaml = yaml
+        except ImportError:
+            Globals.yaml = FakeYaml
+    return Globals.yaml
+
+# the types which _yaml_dump() writes with the libyaml dumpers
+_YAML_CONTAINERS = frozenset((dict, list, tuple, set))
+
+def _yaml_dump(data, **kwargs):
+    """
+    yaml.dump() with the safe dumper, or the full dumper for data that the safe one cannot
+    represent (eg arbitrary objects). Only containers use the libyaml dumpers, as they do not end
+    a document which is a single plain scalar with "...", as the python dumpers do.
+    """
+    yaml = _yaml()
+    if yaml is FakeYaml:
+        return FakeYaml.dump(data, **kwargs)
+    np = sys.modules.get("numpy")
+    if np is not None and Globals.yaml_numpy is not np:
+        _yaml_add_numpy(np)
+    (safe, full) = Globals.yaml_dumpers if type(data) in _YAML_CONTAINERS else Globals.yaml_scalar_dumpers
+    try:
+        return yaml.dump(data, Dumper=safe, **kwargs)
+    except yaml.representer.RepresenterError:
+        return yaml.dump(data, Dumper=full, **kwargs)
+
+def _yaml_add_numpy(np):
+    """
+    Represent numpy arrays as a summary (see ndarray_summary()) and numpy scalars as the
+    equivalent python value, as _json_default() does for json.
+    """
+    for dumper in Globals.yaml_dumpers + Globals.yaml_scalar_dumpers:
+        dumper.add_multi_representer(np.ndarray, lambda d, a: d.represent_str(ndarray_summary(a, 6)))
+        dumper.add_multi_representer(np.generic, lambda d, v: d.represent_data(v.item()))
+    Globals.yaml_numpy = np
+
+def __getattr__(name):
+    # these modules used to be imported along with this module, but are now imported on first use
+    if name == 'yaml':
+        return _yaml()
+    if name in ('re', 'json', 'logging', 'traceback'):
+        return __import__(name)
+    if name == 'pformat':
+        from pprint import pformat
+        return pformat
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class GlobalLoggingInstance:
     # pylint: disable=too-few-public-methods
@@ -85,6 +190,7 @@ class GlobalLoggingInstance:
         Set up the global logging instance with some default configuration.
         """
         # logging setup
+        import logging
         log = logging.getLogger(progname())
         log.setLevel(logging.INFO)
         ch = logging.StreamHandler(sys.stderr)
@@ -165,21 +271,47 @@ class Globals:
     VERBOSE = 0
     DEBUG = 0
     DEBUG_REGEX = None
-    # used by output_add, output_pop and 'eo'
-    output_stack = []
-    output_handle = None
+    # the output stack used by output_add, output_pop and 'eo' is kept per thread
+    # and per asyncio task, see OutputState
+    # used by dbgmsg and dbgdump, see _debug_site()
+    callsites = {}
+    callsite_prog = None
+    debug_site_rules = []
+    # used by eo, see _printer() and _firstformat_count()
+    printers = {}
+    firstformat_counts = {}
+    cache_limit = 1024
+    # used by pretty and pretty_to, see _json_encoder()
+    json_encoders = {}
+    # the size of the writes made by pretty_to() and eo(style="json")
+    stream_chunk = 65536
+    # the yaml module (or FakeYaml) and its (safe, full) dumper classes, for containers and
+    # for other values, see _yaml()
+    yaml = None
+    yaml_dumpers = None
+    yaml_scalar_dumpers = None
+    # the numpy module whose types have been added to the dumpers, see _yaml_add_numpy()
+    yaml_numpy = None
+    # used by eo and msgx, see set_rate_limit() and _rate_allowed()
+    rate_limit = None
+    rate_limiters = {}
+    rate_parsed = {}
+    rate_summary_interval = 10.0
+    rate_atexit_registered = False
+    # used by structured output, see _call_site()
+    record_sites = {}
+    library_files = {}
+    # used by the binary log, see _join_template()
+    join_templates = {}
 
 Globals.VERBOSE = _init_level('VERBOSE', 0)
 Globals.DEBUG = _init_level('DEBUG', 0)
-Globals.DEBUG_REGEX = os.environ.get('DEBUG_REGEX', None)
-
-globals()['VERBOSE'] = Globals.VERBOSE
-globals()['DEBUG'] = Globals.DEBUG
-globals()['DEBUG_REGEX'] = Globals.DEBUG_REGEX
 
 def set_debug_regex(pattern):
     """
     Set a regular expression that will select which debug lines should be displayed.
+    The pattern is searched for in the name ("file:func:line") of each dbgmsg() or dbgdump() call site,
+    and replaces any rules added by debug_site_enable() or debug_site_disable().
 
     Parameters:
         pattern (str|regex): the pattern, or None
@@ -187,7 +319,17 @@ def set_debug_regex(pattern):
     if pattern is None or pattern == '':
         Globals.DEBUG_REGEX = None
     else:
+        import re
         Globals.DEBUG_REGEX = re.compile(pattern)
+    Globals.debug_site_rules = []
+    for site in Globals.callsites.values():
+        site.enabled = _debug_site_enabled(site.name)
+
+set_debug_regex(os.environ.get('DEBUG_REGEX', None))
+
+globals()['VERBOSE'] = Globals.VERBOSE
+globals()['DEBUG'] = Globals.DEBUG
+globals()['DEBUG_REGEX'] = Globals.DEBUG_REGEX
 
 def increment_debug(amount=None):
     """
@@ -271,6 +413,56 @@ def get_debug():
     """
     return Globals.DEBUG
 
+def set_stats(enabled=True):
+    """
+    Enable (or disable) counting the calls of the output routines (eo, msgx, stringify, pretty,
+    dbgmsg and output_pop), the characters they produce, and the time they spend formatting
+    and writing, and the calls of verb and vverb which print nothing. See stats().
+
+    Parameters:
+        enabled (bool): whether to count
+    """
+    Instrument.enabled = bool(enabled)
+
+def stats():
+    """
+    Return the counters collected since set_stats() was enabled (or stats_reset() was called).
+    Calls made from within other routines are counted for each, eg msg() counts for msgx, stringify and eo.
+
+    Returns:
+        dict: a map of routine name to a dict of: calls, suppressed (the calls which were discarded,
+        eg by disabled debugging or a NullSink), bytes (the size of the output, as utf-8), format_ns and write_ns
+    """
+    return { name: c.as_dict() for name, c in sorted(Instrument.counters.items()) }
+
+def stats_reset():
+    """
+    Reset the counters returned by stats().
+    """
+    Instrument.counters.clear()
+
+def set_rate_limit(rate, summary_interval=None):
+    """
+    Set the default rate limit of the eo() and msg() family of calls, applied separately to
+    each call site. A call can override it with eo(..., rate=...), see eo().
+    The messages over the limit are dropped before they are formatted, and replaced by a
+    "suppressed N messages from file:line" line, see rate_limit_flush().
+
+    Parameters:
+        rate (str|float|None): eg "10/s", "100/min" or "1000/h", a number of messages per second,
+            or None to disable the default limit
+        summary_interval (float): while a site is being suppressed, report the count this often (in seconds)
+
+    Raises:
+        ValueError: if the rate cannot be parsed
+    """
+    if rate is not None:
+        _rate_per_second(rate)
+    Globals.rate_limit = rate
+    if summary_interval is not None:
+        Globals.rate_summary_interval = summary_interval
+    Globals.rate_limiters.clear()
+
 def set_debug(amount=1):
     """
     Set the current global debug verbosity level
@@ -284,6 +476,63 @@ def set_debug(amount=1):
     Globals.DEBUG = amount
     return Globals.DEBUG
 
+class OutputState:
+    """
+    An immutable snapshot of the output stack, with its top destination resolved up front.
+
+    There is a process-wide stack (Globals.output_base), which the main thread changes, and
+    which every thread and asyncio task prints to by default. Other threads, and asyncio
+    tasks, which add destinations get their own stack of those, held in a context variable,
+    so captures (output_buffer(), timed()) running concurrently do not mix their output.
+    Once they have removed them again, they print to the process-wide stack again.
+    Asyncio tasks start with a copy of the stack of the code which created them.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('stack', 'handle', 'write', 'discard', 'records', 'deferred')
+
+    def __init__(self, stack):
+        self.stack = stack
+        self.handle = stack[-1] if stack else None
+        # the pre-bound write method of the handle, and whether it discards everything
+        self.write = self.handle.write if stack else None
+        self.discard = getattr(self.handle, 'discard', False) is True
+        # whether the handle takes structured records, see eyeo.structured.RecordSink
+        self.records = getattr(self.handle, 'records', False) is True
+        # whether it also takes the unformatted calls, see eyeo.binlog.BinlogSink
+        self.deferred = self.records and getattr(self.handle, 'deferred', False) is True
+
+# the destinations added by this thread or task, or None to use Globals.output_base
+_output_state = contextvars.ContextVar("eyeo_output_state", default=None)
+Globals.output_base = OutputState(())
+_output_base_lock = threading.Lock()
+
+def _after_fork_in_child():
+    # another thread of the parent may have held the lock at the time of the fork
+    global _output_base_lock # pylint: disable=global-statement
+    _output_base_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def _current_state():
+    state = _output_state.get()
+    return Globals.output_base if state is None else state
+
+def _local_context():
+    """
+    Return True if output_add() should only change the stack of this context, ie outside
+    of the main thread, or in an asyncio task.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return True
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is not None:
+        try:
+            return asyncio.current_task() is not None
+        except RuntimeError:
+            # no running event loop
+            pass
+    return False
+
 def output_add(fhandle):
     """
     Set the current default output target filehandle for output routines in this module.
@@ -296,10 +545,24 @@ def output_add(fhandle):
     Returns:
         file: the file handle that was passed in
     """
-    Globals.output_stack.append(fhandle)
-    Globals.output_handle = fhandle
+    local = _output_state.get()
+    if local is not None or _local_context():
+        _output_state.set(OutputState((local.stack if local is not None else ()) + (fhandle,)))
+    else:
+        with _output_base_lock:
+            Globals.output_base = OutputState(Globals.output_base.stack + (fhandle,))
     return fhandle
 
+def output_current():
+    """
+    Return the current output destination, ie the top of the output stack, or sys.stderr.
+
+    Returns:
+        file: the current output destination
+    """
+    handle = _current_state().handle
+    return handle if handle is not None else sys.stderr
+
 def output_buffer():
     """
     Create a new string buffer in the output stack and return it. The new string buffer
@@ -311,6 +574,88 @@ def output_buffer():
     """
     return output_add(StringIO())
 
+def output_background(fhandle=None, maxsize=1024, overflow="block"):
+    """
+    Make the output routines write through a queue to a background thread, so that they do
+    not stall when the destination is slow. The new BackgroundWriter is added to the output stack,
+    and it is flushed and stopped when it is removed again with output_pop().
+
+    Parameters:
+        fhandle (file): the destination, or None for the current output destination
+        maxsize (int): the maximum number of queued writes
+        overflow (str): what to do when the queue is full, one of "block", "drop", "drop-oldest"
+
+    Returns:
+        BackgroundWriter: the new output destination
+    """
+    if fhandle is None:
+        fhandle = output_current()
+    return output_add(BackgroundWriter(fhandle, maxsize=maxsize, overflow=overflow))
+
+def output_dedup(fhandle=None, timeout=None):
+    """
+    Make the output routines collapse repeated messages: a message which is the same as the
+    previous one is counted instead of written, and the count is written as
+    "last message repeated N times" when a different message is printed, after timeout seconds,
+    or when the destination is flushed (eg by output_pop()). See DedupSink.
+
+    Parameters:
+        fhandle (file): the destination, or None for the current output destination
+        timeout (float): the longest time (in seconds) to hold back a count, or None to wait for a change or flush
+
+    Returns:
+        DedupSink: the new output destination
+    """
+    if fhandle is None:
+        fhandle = output_current()
+    return output_add(DedupSink(fhandle, timeout=timeout))
+
+def output_records(fmt="jsonl", fhandle=None):
+    """
+    Make the output routines write one structured record per call, as JSON Lines or logfmt,
+    with the time, level, call site, message and arguments as separate fields.
+    See eyeo.structured, and eo(..., style="jsonl") for a single call.
+
+    Parameters:
+        fmt (str): one of "jsonl" or "logfmt"
+        fhandle (file): the destination, or None for the current output destination
+
+    Returns:
+        RecordSink: the new output destination
+    """
+    from eyeo.structured import RecordSink
+    if fhandle is None:
+        fhandle = output_current()
+    return output_add(RecordSink(fhandle, fmt))
+
+def output_binlog(target, buffer_size=65536):
+    """
+    Make the output routines write a binary log, in which each call is written as the id of its
+    call site and format string, and its packed arguments. The text is formatted later, by
+    "python -m eyeo.binlog" (see eyeo.binlog). The log is flushed by output_pop() and at exit.
+
+    Parameters:
+        target (str|file): a path, or a file opened in binary mode
+        buffer_size (int): the number of bytes to buffer before writing
+
+    Returns:
+        BinlogSink: the new output destination
+    """
+    from eyeo.binlog import BinlogSink
+    return output_add(BinlogSink(target, buffer_size=buffer_size))
+
+def output_flush():
+    """
+    Flush every destination in the output stack, including any queued background output.
+    """
+    local = _output_state.get()
+    if local is not None:
+        for fhandle in reversed(local.stack):
+            fhandle.flush()
+    for fhandle in reversed(Globals.output_base.stack):
+        fhandle.flush()
+    sys.stderr.flush()
+
 def output_pop(print_to_upper=False):
     """
     Remove the current output destination from the stack of output targets.
@@ -327,33 +672,49 @@ def output_pop(print_to_upper=False):
     Returns:
          None | tuple(file, int, str): None, or a tuple of the removed file, length of any popped string buffer data, and any popped string buffer data
     """
-    if not Globals.output_stack:
+    local = _output_state.get()
+    if local is not None:
+        stack = local.stack
+        _output_state.set(OutputState(stack[:-1]) if len(stack) > 1 else None)
+    else:
+        with _output_base_lock:
+            stack = Globals.output_base.stack
+            if stack:
+                Globals.output_base = OutputState(stack[:-1])
+    if not stack:
         print(" output_pop is returning None because there is no output stack", file=sys.stderr)
         return None
+    if Instrument.enabled:
+        start = perf_counter_ns()
+        ret = _output_pop(stack[-1], print_to_upper)
+        c = counter("output_pop")
+        c.calls += 1
+        c.bytes += encoded_size(ret[2]) if ret[2] else 0
+        c.write_ns += perf_counter_ns() - start
+        return ret
+    return _output_pop(stack[-1], print_to_upper)
+
+def _output_pop(ret, print_to_upper):
 
     len_value = None
     data_value = None
-    popped = Globals.output_stack.pop()
-    ret = Globals.output_handle
-    if ret != popped:
-        print("ERROR: output stack got out of sync with expected output handle", file=sys.stderr)
-
-    if Globals.output_stack:
-        Globals.output_handle = Globals.output_stack[-1]
-    else:
-        Globals.output_handle = None
 
     if isinstance(ret, StringIO):
         ret.seek(0)
         data_value = ret.read()
         len_value = len(data_value)
+    elif isinstance(ret, StringSink):
+        data_value = ret.getvalue()
+        len_value = len(data_value)
     if print_to_upper:
         if data_value:
-            eo(data_value, end="")
+            eo(data_value, end="", rate=False)
         else:
             #print(f"Popped handle is of type ({type(ret)}), cannot print_to_upper", file=sys.stderr)
             pass
 
+    if isinstance(ret, BackgroundWriter):
+        ret.close()
     ret.flush()
     #print(f" output_pop is returning ret={ret}, len_value={len_value}, data_value={data_value}", file=sys.stderr)
     return (ret, len_value, data_value)
@@ -495,15 +856,633 @@ def pretty(data, style=None, sort_keys=None, indent=None):
         style = 'json'
     if sort_keys is None:
         sort_keys = True
+    if Instrument.enabled:
+        start = perf_counter_ns()
+        text = _pretty(data, style, sort_keys, indent)
+        count_call("pretty", start, encoded_size(text))
+        return text
+    return _pretty(data, style, sort_keys, indent)
+
+def _pretty(data, style, sort_keys, indent):
     if style == 'yaml':
-        return yaml.dump(data, sort_keys=sort_keys, default_flow_style=False, indent=indent, default_style=None, line_break="\n")
-    return json.dumps(data, sort_keys=sort_keys, separators=(", ", " : "), indent=indent)
+        return _yaml_dump(data, sort_keys=sort_keys, default_flow_style=False, indent=indent, default_style=None, line_break="\n")
+    return _json_encoder(sort_keys, indent).encode(data)
+
+def pretty_to(stream, data, style=None, sort_keys=None, indent=None):
+    """
+    Like pretty(), but write the text to a stream as it is produced, in writes of up to
+    Globals.stream_chunk characters, rather than building the whole document in memory.
+
+    Parameters:
+        stream (file): anything with a write(str) method
+        (others): see pretty()
+    """
+    if style == 'yaml':
+        stream.write(pretty(data, style, sort_keys, indent))
+        return
+    if indent is None:
+        indent = 4
+    if sort_keys is None:
+        sort_keys = True
+    out = _Coalescer(stream.write)
+    _json_to(out, data, sort_keys, indent)
+    out.flush()
+
+def _json_encoder(sort_keys, indent, separators=(", ", " : ")):
+    """
+    Return a cached json encoder for a combination of options.
+    """
+    key = (sort_keys, indent, separators)
+    encoder = Globals.json_encoders.get(key)
+    if encoder is None:
+        import json
+        encoder = json.JSONEncoder(sort_keys=sort_keys, indent=indent, separators=separators, default=_json_default)
+        Globals.json_encoders[key] = encoder
+    return encoder
+
+def _json_to(out, data, sort_keys=True, indent=4):
+    write = out.write
+    for chunk in _json_encoder(sort_keys, indent).iterencode(data):
+        write(chunk)
+
+class _Coalescer:
+    """
+    Collects many small writes (eg the chunks from json iterencode()) into a few large ones.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('target', 'parts', 'size', 'limit')
+
+    def __init__(self, target, limit=None):
+        self.target = target
+        self.parts = []
+        self.size = 0
+        self.limit = Globals.stream_chunk if limit is None else limit
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            data = "".join(self.parts)
+            self.parts = []
+            self.size = 0
+            self.target(data)
+
+def _json_default(o):
+    """
+    Convert the values which json cannot: numpy arrays become a summary (see ndarray_summary()),
+    and numpy scalars the equivalent python value. numpy is not imported for this.
+    """
+    np = sys.modules.get("numpy")
+    if np is not None:
+        if isinstance(o, np.ndarray):
+            return ndarray_summary(o, 6)
+        if isinstance(o, np.generic):
+            return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+def _stringified(x, maxDepth=None, maxItems=-1, maxStrlen=-1):
+    """
+    Convert a value with stringify_to(), so that the text is built in one buffer
+    rather than copied at every level of the structure.
+    """
+    buf = StringIO()
+    stringify_to(buf, x, maxDepth, maxItems, maxStrlen)
+    return buf.getvalue()
+
+def _style_stringify(x):
+    return _stringified(x)
+
+def _style_json(x):
+    return pretty(x, style='json')
+
+def _style_yaml(x):
+    return pretty(x, style='yaml')
+
+# conversion routines for the eo() 'style' option
+styles = {
+    "s": str,
+    "str": str,
+    "r": repr,
+    "repr": repr,
+    "stringify": _style_stringify,
+    "j": _style_json,
+    "json": _style_json,
+    "y": _style_yaml,
+    "yaml": _style_yaml,
+}
+
+def _stringify_item_to(out, x):
+    stringify_to(out, x)
+
+# the styles whose items are written as they are converted, see Printer._write_streamed()
+_STREAMED_STYLES = { _style_json: _json_to, _style_stringify: _stringify_item_to }
+
+def _firstformat_count(text):
+    """
+    Return the number of "{}" placeholders in a string, caching the result so that
+    the eo("a format {} with {}", ...) check does not rescan the same format string.
+
+    Parameters:
+        text (str): the first argument passed to eo()
+
+    Returns:
+        int: the number of "{}" placeholders
+    """
+    count = Globals.firstformat_counts.get(text)
+    if count is None:
+        if len(Globals.firstformat_counts) >= Globals.cache_limit:
+            Globals.firstformat_counts.clear()
+        count = text.count("{}")
+        Globals.firstformat_counts[text] = count
+    return count
+
+class Printer:
+    """
+    A reusable eo(), with all of the eo() options resolved once up front.
+    See printer() and eo().
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, file=None, end=None, flush=None,
+                 joiner=None, starter=None, indent=None,
+                 style=None, fmt=None, quote=None, quote_if=None,
+                 nonestr=None, lf=None, _debug=None):
+        # pylint: disable=too-many-arguments,too-many-locals
+        self.file = file
+        self.end = end
+        self.flush = flush
+
+        # Support this style:
+        #    eo("a format {} with {}", "string", "data")
+        # as long as no other contradictory options were passed
+        self.firstformat = fmt is None and indent is None and joiner is None and style is None
+
+        if nonestr is None:
+            nonestr = "(None)"
+        if lf is None:
+            lf = os.linesep
+        if style is None:
+            style = 'str'
+        if quote_if is not None and quote is None:
+            quote = "'"
+        if quote_if is None:
+            quote_if = 'empty,space,quote'
+        if joiner is None:
+            joiner = " "
+        if indent is not None:
+            joiner = lf
+            if fmt is None:
+                fmt = indent + "{val}"
+            else:
+                fmt = indent + fmt
+
+        self.nonestr = nonestr
+        self.quote = quote
+        self.quote_if = quote_if
+        self.joiner = joiner
+        self.prefix = "" if starter is None else starter
+        self.fmt = fmt
+        self.format_fmt = fmt.format if fmt else None
+        self.convert = styles.get(style, str)
+        # print a structured record (see eyeo.structured) rather than text
+        self.record = style if style in _RECORD_STYLES else None
+        # whether a binary log can take the unformatted items, see _write_deferred()
+        self.deferrable = style in ('s', 'str') and fmt is None and quote is None and self.prefix == ""
+        self.debug = _debug
+        # json and stringify output is written as it is converted, unless the whole item is needed for formatting
+        self.stream_item = _STREAMED_STYLES.get(self.convert) if fmt is None and quote is None else None
+
+    def format_val(self, x, idx=None):
+        """
+        Convert a single item to a string as eo() would.
+
+        Parameters:
+            x: the value
+            idx (int|None): the index of the item, for use by the fmt option
+
+        Returns:
+            str: the formatted item
+        """
+        t = type(x)
+        if t is Lazy:
+            x = x.value()
+            t = type(x)
+        if x is None:
+            return self.nonestr
+        if t in typerepresenters:
+            rep = typerepresenters[t]
+            if callable(rep):
+                x = rep(x)
+            else:
+                x = rep
+
+        if self.format_fmt:
+            ret = self.format_fmt(idx=idx, val=x)
+        else:
+            ret = self.convert(x)
+        if self.quote:
+            orig = ret
+            ret = quoted(ret, quote=self.quote, quote_if=self.quote_if)
+            if self.debug:
+                print(f"ret={ret} for quoted(\"{orig}\",quote=\"{self.quote}\", quote_if=\"{self.quote_if}\"")
+        elif self.debug:
+            print("NOT using quoted(), quote=" + str(self.quote) + " and quote_if=" + str(self.quote_if), file=sys.stderr)
+        return ret
+
+    def format(self, args):
+        """
+        Return the text that eo() would print for some items, without the line ending.
+
+        Parameters:
+            args (tuple|list): the items
+
+        Returns:
+            str: the formatted line
+        """
+        if self.firstformat and args:
+            first = args[0]
+            if first and isinstance(first, str):
+                count = _firstformat_count(first)
+                if count and count == len(args) - 1:
+                    return first.format(*args[1:])
+
+        if self.debug:
+            print(f"quote={self.quote}, quote_if={self.quote_if}")
+
+        if len(args) == 1 and isinstance(args[0], list):
+            args = args[0]
+
+        format_val = self.format_val
+        if self.format_fmt:
+            strs = [ format_val(v, i) for i, v in enumerate(args) ]
+        else:
+            strs = [ format_val(v) for v in args ]
+
+        return self.prefix + self.joiner.join(strs)
+
+    def write(self, args, file=None, end=None, flush=None):
+        """
+        Format some items and print them, as eo() would.
+
+        Parameters:
+            args (tuple|list): the items
+            file, end, flush: see eo()
+        """
+        if file is None:
+            state = _output_state.get()
+            if state is None:
+                state = Globals.output_base
+            if state.discard:
+                if Instrument.enabled:
+                    count_suppressed("eo")
+                return
+            if state.records:
+                if state.deferred:
+                    self._write_deferred(state.handle, args, flush, "\n" if end is None else end)
+                else:
+                    self._write_record(state.handle.emit, args, flush)
+                return
+            write = state.write or sys.stderr.write
+        else:
+            write = file.write
+
+        if self.record or (file is not None and isinstance(file, Sink) and file.records):
+            self._write_record(_record_emitter(None, file, self.record), args, flush, file)
+            return
+
+        if Instrument.enabled:
+            self._write_counted(args, write, "\n" if end is None else end)
+        elif self.stream_item:
+            self._write_streamed(args, write, "\n" if end is None else end)
+        else:
+            # a single write, so that the line and its ending are never separated
+            write(self.format(args) + ("\n" if end is None else end))
+
+        if flush:
+            if file is None:
+                file = output_current()
+            file.flush()
+
+    def _write_record(self, emit, args, flush, file=None):
+        """
+        Print the items as a structured record, with the formatted text as its message.
+        """
+        message = self.format(args)
+        if len(args) == 1 and isinstance(args[0], list):
+            args = args[0]
+        elif self.firstformat and args and isinstance(args[0], str) and _firstformat_count(args[0]) == len(args) - 1:
+            # the format string is part of the message
+            args = args[1:]
+        emit("info", _call_site(), message, [ _evaluated(x) for x in args ])
+        if flush:
+            (file if file is not None else output_current()).flush()
+
+    def _write_deferred(self, handle, args, flush, end):
+        """
+        Pass the items to a binary log (see eyeo.binlog) with a format string, rather than formatting them.
+        Items which need the eo() formatting options (eg indent) are formatted, and passed as a single item.
+        """
+        original = args
+        fmt = None
+        if not self.deferrable:
+            fmt = "{}"
+            args = [ self.format(args) ]
+        elif self.firstformat and args:
+            first = args[0]
+            if first and isinstance(first, str):
+                count = _firstformat_count(first)
+                if count and count == len(args) - 1:
+                    fmt = first
+                    args = [ x.value() if type(x) is Lazy else x for x in args[1:] ]
+        if fmt is None:
+            if len(args) == 1 and isinstance(args[0], list):
+                args = args[0]
+            fmt = _join_template(self.joiner, len(args))
+            args = [ x.value() if type(x) is Lazy else x for x in args ]
+            args = [ self.nonestr if x is None else x for x in args ]
+        if typerepresenters and any(type(x) in typerepresenters for x in args):
+            (fmt, args) = ("{}", [ self.format(original) ])
+        handle.log("info", _caller(), fmt, args, end)
+        if flush:
+            handle.flush()
+
+    def _write_counted(self, args, write, end):
+        """
+        write(), with the formatting and writing time counted, see set_stats().
+        """
+        c = counter("eo")
+        start = perf_counter_ns()
+        if self.stream_item:
+            # the writes are interleaved with the formatting, so they are counted as formatting
+            sizes = []
+            def counted(text):
+                sizes.append(encoded_size(text))
+                write(text)
+            self._write_streamed(args, counted, end)
+            c.bytes += sum(sizes)
+            c.format_ns += perf_counter_ns() - start
+        else:
+            text = self.format(args) + end
+            formatted = perf_counter_ns()
+            write(text)
+            c.bytes += encoded_size(text)
+            c.format_ns += formatted - start
+            c.write_ns += perf_counter_ns() - formatted
+        c.calls += 1
+
+    def _write_streamed(self, args, write, end):
+        """
+        Write items in the json or stringify style as they are converted. Output which fits in
+        Globals.stream_chunk is still a single write.
+        """
+        if len(args) == 1 and isinstance(args[0], list):
+            args = args[0]
+        out = _Coalescer(write)
+        out.write(self.prefix)
+        for i, x in enumerate(args):
+            if i:
+                out.write(self.joiner)
+            if x is None or type(x) is Lazy or type(x) in typerepresenters:
+                out.write(self.format_val(x))
+            else:
+                self.stream_item(out, x)
+        out.write(end)
+        out.flush()
+
+    def __call__(self, *args):
+        self.write(args, file=self.file, end=self.end, flush=self.flush)
+
+def printer(**kwargs):
+    """
+    Return a reusable callable which prints its arguments like eo(), with the eo() options
+    parsed just once. Useful in tight loops which print many times with the same options.
+
+    example usage:
+    p = printer(indent="  ", quote_if="s")
+    for row in rows:
+        p(*row)
+
+    Parameters:
+        kwargs: see eo()
+
+    Returns:
+        Printer: the printer
+    """
+    return Printer(**kwargs)
+
+def _printer(joiner=None, starter=None, indent=None, style=None, fmt=None,
+             quote=None, quote_if=None, nonestr=None, lf=None, _debug=None):
+    """
+    Return a cached Printer for a combination of eo() formatting options.
+    """
+    # pylint: disable=too-many-arguments
+    key = (joiner, starter, indent, style, fmt, quote, quote_if, nonestr, lf, _debug)
+    try:
+        found = Globals.printers.get(key)
+    except TypeError:
+        # unhashable options, eg a joiner which is not a string
+        key = None
+        found = None
+    if found is None:
+        found = Printer(joiner=joiner, starter=starter, indent=indent, style=style, fmt=fmt,
+                        quote=quote, quote_if=quote_if, nonestr=nonestr, lf=lf, _debug=_debug)
+        if key is not None:
+            if len(Globals.printers) >= Globals.cache_limit:
+                Globals.printers.clear()
+            Globals.printers[key] = found
+    return found
+
+class _RateLimiter:
+    """
+    A token bucket for the messages of one call site (or explicit key), see _rate_allowed().
+    The bucket holds up to a second's worth of messages (at least 1), so short bursts pass.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('name', 'rate', 'capacity', 'tokens', 'last', 'suppressed', 'reported')
+
+    def __init__(self, name, rate, now):
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = now
+        self.suppressed = 0
+        self.reported = now
+
+    def allow(self, rate, now, file):
+        if rate != self.rate:
+            self.rate = rate
+            self.capacity = max(1.0, rate)
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * rate)
+        self.last = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            if self.suppressed:
+                self.report(now, file)
+            return True
+        self.suppressed += 1
+        if now - self.reported >= Globals.rate_summary_interval:
+            self.report(now, file)
+        return False
+
+    def report(self, now, file=None):
+        count = self.suppressed
+        self.suppressed = 0
+        self.reported = now
+        eo(f"suppressed {count} message{'' if count == 1 else 's'} from {self.name}", file=file, rate=False)
+
+_RATE_UNITS = { 's': 1.0, 'sec': 1.0, 'second': 1.0, 'm': 60.0, 'min': 60.0, 'minute': 60.0,
+                'h': 3600.0, 'hour': 3600.0 }
+
+def _rate_per_second(rate):
+    """
+    Convert a rate ("10/s", "100/min", "5/h" or a number of messages per second) to messages per second.
+    The parsed strings are cached.
+    """
+    if isinstance(rate, (int, float)):
+        found = float(rate)
+    else:
+        found = Globals.rate_parsed.get(rate)
+        if found is None:
+            count, _, unit = str(rate).partition("/")
+            seconds = _RATE_UNITS.get(unit.strip().lower() or 's')
+            try:
+                found = float(count) / seconds
+            except (TypeError, ValueError):
+                found = -1.0
+            if found <= 0:
+                raise ValueError(f"invalid rate: {rate!r}, expected eg \"10/s\", \"100/min\" or \"1000/h\"")
+            if len(Globals.rate_parsed) >= Globals.cache_limit:
+                Globals.rate_parsed.clear()
+            Globals.rate_parsed[rate] = found
+    if found <= 0:
+        raise ValueError(f"invalid rate: {rate!r}, the rate must be positive")
+    return found
+
+_PACKAGE_DIR = os.path.dirname(__file__)
+
+def _library_file(filename):
+    """
+    Return True if a source file is one of the eyeo modules (eg this one, or eyeo/aio.py),
+    rather than one of their tests. The answers are cached in Globals.library_files.
+    """
+    found = Globals.library_files.get(filename)
+    if found is None:
+        found = os.path.dirname(filename) == _PACKAGE_DIR and not filename.endswith("_test.py")
+        Globals.library_files[filename] = found
+    return found
+
+def _caller():
+    """
+    Return the code location, (code, line number), of the first caller outside the eyeo package.
+    """
+    # pylint: disable=protected-access
+    frame = sys._getframe(1)
+    while frame.f_back is not None and _library_file(frame.f_code.co_filename):
+        frame = frame.f_back
+    return (frame.f_code, frame.f_lineno)
+
+def _call_site():
+    """
+    Return the name, "file:line", of the first caller outside this module. The names are cached.
+    """
+    key = _caller()
+    name = Globals.record_sites.get(key)
+    if name is None:
+        name = f"{os.path.basename(key[0].co_filename)}:{key[1]}"
+        Globals.record_sites[key] = name
+    return name
+
+# the styles which print a structured record rather than text, see eyeo.structured
+_RECORD_STYLES = ( "jsonl", "logfmt" )
+
+# the level of msgx() records which start with one of these items, see warnmsg(), err() and info()
+_LEVEL_PREFIXES = { "ERROR:": "error", "WARNING:": "warning", "INFO:": "info" }
+
+def _join_template(joiner, count):
+    """
+    Return the str.format() template of count items joined by joiner, eg "{} {}". The templates are cached.
+    """
+    key = (joiner, count)
+    found = Globals.join_templates.get(key)
+    if found is None:
+        escaped = joiner.replace("{", "{{").replace("}", "}}")
+        found = escaped.join(["{}"] * count)
+        if len(Globals.join_templates) >= Globals.cache_limit:
+            Globals.join_templates.clear()
+        Globals.join_templates[key] = found
+    return found
+
+def _record_emitter(state, file, style):
+    """
+    Return the function which writes a structured record for a call, or None if the call prints text.
+
+    Parameters:
+        state (OutputState): the current output state
+        file: the file option of the call
+        style: the style option of the call
+
+    Returns:
+        callable|None: emit(level, site, message, args)
+    """
+    if style in _RECORD_STYLES:
+        from eyeo.structured import ENCODERS
+        encode = ENCODERS[style]
+        write = (file if file is not None else output_current()).write
+        return lambda level, site, message, args: write(encode(level, site, message, args))
+    if file is None:
+        return state.handle.emit if state.records else None
+    if isinstance(file, Sink) and file.records:
+        return file.emit
+    return None
+
+def _rate_allowed(rate, key, file):
+    """
+    Decide whether a rate limited call may print, before any of its arguments are formatted.
+
+    Parameters:
+        rate: the limit, see set_rate_limit()
+        key (str|None): the limiter to use, or None for the call site (the first caller outside this module)
+        file: the destination of the call, also used for any "suppressed" summary
+
+    Returns:
+        bool: True if the call may print
+    """
+    per_second = _rate_per_second(rate)
+    if key is None:
+        key = _caller()
+    limiter = Globals.rate_limiters.get(key)
+    now = time.monotonic()
+    if limiter is None:
+        if not Globals.rate_atexit_registered:
+            import atexit
+            atexit.register(rate_limit_flush)
+            Globals.rate_atexit_registered = True
+        name = key if isinstance(key, str) else f"{os.path.basename(key[0].co_filename)}:{key[1]}"
+        limiter = Globals.rate_limiters.setdefault(key, _RateLimiter(name, per_second, now))
+    if limiter.allow(per_second, now, file):
+        return True
+    if Instrument.enabled:
+        count_suppressed("rate_limit")
+    return False
+
+def rate_limit_flush():
+    """
+    Print the "suppressed N messages" summary of every rate limited site which has dropped
+    messages since its last summary. This is done automatically at exit.
+    """
+    now = time.monotonic()
+    for limiter in list(Globals.rate_limiters.values()):
+        if limiter.suppressed:
+            limiter.report(now)
 
 def eo(*args, file=None, end=None, flush=None,
             joiner=None, starter=None, indent=None,
             style=None, fmt=None, quote=None, quote_if=None,
-            nonestr=None, lf=None, _debug=None):
-    # pylint: disable=too-many-locals
+            nonestr=None, lf=None, _debug=None, rate=None, rate_key=None):
     """
     example usage:
     # basic usage, will write to stderr
@@ -532,125 +1511,22 @@ def eo(*args, file=None, end=None, flush=None,
        joiner(string, ""):           use this string to join each item
        starter(string, ""):          use this string at the start when indenting items
        indent(string,"    "):        print this and a linefeed between each item
-       style(string,"str"):          one of s,str, r,repr, stringify, j,json, y,yaml
+       style(string,"str"):          one of s,str, r,repr, stringify, j,json, y,yaml, or jsonl,logfmt for a structured record (see output_records())
        fmt(string, ""):              use this format string for each item (uses 'idx' and 'val' to allow numbered lines or items)
        quote(string, "'"):           use this character for quoting
        quote_if(string, "e,s,q"):    specify when to wrap in quotes (e=empty,s=contains spaces, q=contains the quote character, a=always)
        nonestr(string,"")            replace None with this string in some situations
        lf(string, "\n"):             use this as the line separator (replaces joiner when indent mode is enabled)
+       rate(string, None):           limit the calls from this call site, eg "10/s" or "100/min" (see set_rate_limit(), False disables the default limit)
+       rate_key(string, None):       share the rate limit between the call sites which use this key
 
+    The parsed options are cached (see printer()), so repeated calls with the same options are cheap.
     """
-
-    # pylint: disable=too-many-statements,too-many-branches
-
-    args = list(args)
-    strs = []
-
-    # Support this style:
-    #    eo("a format {} with {}", "string", "data")
-    # as long as no other contradictory options were passed
-    # pylint: disable=too-many-boolean-expressions
-    if (fmt is None
-        and args
-        and args[0]
-        and isinstance(args[0], str)
-        and "{}" in args[0]
-        and args[0].count("{}") == len(args) -1
-        and indent is None and joiner is None and style is None):
-        fmt = args.pop(0)
-        if file is None:
-            file = Globals.output_handle if Globals.output_handle else sys.stderr
-        print(fmt.format(*args) , file=file, end=end)
-        if flush:
-            file.flush()
+    if rate is None:
+        rate = Globals.rate_limit
+    if rate and not _rate_allowed(rate, rate_key, file):
         return
-
-    if nonestr is None:
-        nonestr = "(None)"
-    if lf is None:
-        lf = os.linesep
-
-    if style is None:
-        style = 'str'
-
-    #if _debug:
-    #    print(f"quote={quote}, quote_if={quote_if}")
-
-    if quote_if is not None and quote is None:
-        quote = "'"
-    #if _debug:
-    #    print(f"quote={quote}, quote_if={quote_if}")
-    if quote_if is None:
-        quote_if = 'empty,space,quote'
-    if _debug:
-        print(f"quote={quote}, quote_if={quote_if}")
-
-    if joiner is None:
-        joiner = " "
-
-    prefix = "" if starter is None else starter
-
-    if indent is not None:
-        joiner = lf
-        if fmt is None:
-            fmt = indent + "{val}"
-        else:
-            fmt = indent + fmt
-
-    def format_val(x, idx=None):
-        if x is None:
-            return x if nonestr is None else nonestr
-        t = type(x)
-        if t in typerepresenters:
-            rep = typerepresenters[t]
-            if callable(rep):
-                x = rep(x)
-            else:
-                x = rep
-
-        ret = x
-        if fmt:
-            ret = fmt.format(idx=idx, val=x)
-        else:
-            if style in [ "s", "str" ]:
-                ret = str(x)
-            elif style in [ "r", "repr" ]:
-                ret = repr(x)
-            elif style in [ "stringify" ]:
-                ret = stringify(x)
-            elif style in [ "j", "json" ]:
-                ret = pretty(x, style='json')
-            elif style in [ "y", "yaml" ]:
-                ret = pretty(x, style='yaml')
-            else:
-                ret = str(x)
-        #if _debug:
-        #    print("Formatting x")
-        if quote:
-            orig = ret
-            ret = quoted(ret, quote=quote, quote_if=quote_if)
-            if _debug:
-                print(f"ret={ret} for quoted(\"{orig}\",quote=\"{quote}\", quote_if=\"{quote_if}\"")
-        elif _debug:# and quote_if:
-            print("NOT using quoted(), quote=" + str(quote) + " and quote_if=" + str(quote_if), file=sys.stderr)
-        return ret
-
-    if len(args) == 1 and isinstance(args[0], list):
-        args = args[0]
-
-    if fmt:
-        strs = [ format_val(v, idx=i) for i, v in enumerate(args) ]
-    else:
-        strs = [ format_val(v) for v in args ]
-
-    line = prefix + joiner.join(strs)
-    if file is None:
-        file = Globals.output_handle if Globals.output_handle else sys.stderr
-
-    print(line , file=file, end=end)
-
-    if flush:
-        file.flush()
+    _printer(joiner, starter, indent, style, fmt, quote, quote_if, nonestr, lf, _debug).write(args, file, end, flush)
 
 def eod(tag, o):
     """
@@ -684,6 +1560,7 @@ def stacktrace(goback=0):
     while goback:
         f = f.f_back
         goback -= 1
+    import traceback
     return "".join(traceback.format_stack(f=f))
 
 def tb(file=None):
@@ -695,6 +1572,7 @@ def tb(file=None):
     """
     if file is None:
         file = sys.stderr
+    import traceback
     traceback.print_stack(file=file)
 
 def current_line_number(frames=1):
@@ -724,6 +1602,62 @@ def eostack():
     eo(stacktrace(2))
     eo("")
 
+class Lazy:
+    """
+    A message argument which is only computed when the message is actually printed.
+    See lazy().
+    """
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def value(self):
+        """
+        Compute the deferred value.
+
+        Returns:
+            the result of calling the function, or of formatting the template
+        """
+        if callable(self.func):
+            return self.func(*self.args, **self.kwargs)
+        return self.func.format(*self.args, **self.kwargs)
+
+    def __str__(self):
+        return str(self.value())
+
+    def __repr__(self):
+        return repr(self.value())
+
+def lazy(func, *args, **kwargs):
+    """
+    Defer the computation of a message argument until it is known that the message will be printed,
+    so that messages suppressed by verb(), vverb() or dbgmsg() cost nothing to format.
+
+    example usage:
+    verb("state:", lazy(build_report, obj))
+    dbgmsg(lazy("{} items in {}", len(items), name))
+
+    Parameters:
+        func (callable|str): a function to call, or a format string
+        args: the arguments for the function or the format string
+        kwargs: the keyword arguments for the function or the format string
+
+    Returns:
+        Lazy: the deferred value
+    """
+    return Lazy(func, args, kwargs)
+
+def _evaluated(x):
+    """
+    Return the value of an item, computing it first if it is a lazy() value.
+    """
+    if isinstance(x, Lazy):
+        return x.value()
+    return x
+
 def msgx(joiner, *args, **kwargs):
     """
     print some data items with a joiner string, but using stringify_value() to convert the items o strings
@@ -732,11 +1666,100 @@ def msgx(joiner, *args, **kwargs):
     Parameters:
         joiner: the object or string to use to join items
         args: the items to join and print
-        kwargs: see eo() for additional information.
-    """
-    items = [ 'None' if x is None else stringify_value(x, 3, 6, 400) for x in args]
+        kwargs: see eo() for additional information, and:
+            level (str): the level of the message in structured output (see output_records()), by default
+                from a leading "ERROR:", "WARNING:" or "INFO:" item, or else "info"
+    """
+    state = _output_state.get()
+    if state is None:
+        state = Globals.output_base
+    if state.discard and kwargs.get('file') is None:
+        if Instrument.enabled:
+            count_suppressed("msgx")
+        return
+    rate = kwargs.pop('rate', None)
+    rate_key = kwargs.pop('rate_key', None)
+    if rate is None:
+        rate = Globals.rate_limit
+    if rate and not _rate_allowed(rate, rate_key, kwargs.get('file')):
+        return
+    level = kwargs.pop('level', None)
+    if state.deferred and kwargs.get('file') is None:
+        _msgx_deferred(state.handle, level, joiner, args, kwargs)
+        return
+    emit = _record_emitter(state, kwargs.get('file'), kwargs.get('style'))
+    if emit is not None:
+        _msgx_record(emit, level, joiner, args, kwargs)
+        return
+    # the items are converted to str, so only a representer for str changes the output
+    if type(joiner) is str and not kwargs.keys() - _MSGX_STREAMED_OPTIONS and str not in typerepresenters and not Instrument.enabled:
+        file = kwargs.get('file')
+        _msgx_streamed((state.write or sys.stderr.write) if file is None else file.write, joiner, args, kwargs.get('end'))
+        if kwargs.get('flush'):
+            (file if file is not None else output_current()).flush()
+        return
+    if Instrument.enabled:
+        start = perf_counter_ns()
+    args = [ _evaluated(x) for x in args ]
+    items = [ 'None' if x is None else _stringified(x, 3, 6, 400) for x in args]
+    if Instrument.enabled:
+        count_call("msgx", start, sum(encoded_size(x) for x in items))
     kwargs['joiner'] = joiner
-    eo(items, **kwargs)
+    eo(items, rate=False, **kwargs)
+
+# the msgx() options which do not need the whole text of the items, see _msgx_streamed()
+_MSGX_STREAMED_OPTIONS = frozenset(('file', 'end', 'flush'))
+
+def _msgx_streamed(write, joiner, args, end):
+    """
+    The text output of msgx(), with each item written as it is converted (see stringify_to()),
+    rather than converted to a string and joined. Output which fits in Globals.stream_chunk
+    is still a single write.
+    """
+    out = _Coalescer(write)
+    for i, x in enumerate(args):
+        if i:
+            out.write(joiner)
+        x = _evaluated(x)
+        if x is None:
+            out.write('None')
+        else:
+            stringify_to(out, x, 3, 6, 400)
+    out.write("\n" if end is None else end)
+    out.flush()
+
+def _msgx_record(emit, level, joiner, args, kwargs):
+    """
+    The structured output of msgx(), with the arguments passed on as they are.
+    """
+    args = [ _evaluated(x) for x in args ]
+    if level is None:
+        level = "info"
+        if args and type(args[0]) is str and args[0] in _LEVEL_PREFIXES:
+            level = _LEVEL_PREFIXES[args[0]]
+            args = args[1:]
+    items = [ 'None' if x is None else _stringified(x, 3, 6, 400) for x in args]
+    emit(level, _call_site(), str(joiner).join(items), args)
+    if kwargs.get('flush'):
+        file = kwargs.get('file')
+        (file if file is not None else output_current()).flush()
+
+def _msgx_deferred(handle, level, joiner, args, kwargs):
+    """
+    msgx() to a binary log (see eyeo.binlog), with the arguments packed rather than formatted.
+    """
+    args = [ _evaluated(x) for x in args ]
+    prefix = ""
+    if level is None:
+        level = "info"
+        if args and type(args[0]) is str and args[0] in _LEVEL_PREFIXES:
+            # as _msgx_record(), the prefix is not part of the message, but is kept for the text
+            level = _LEVEL_PREFIXES[args[0]]
+            prefix = args[0] + str(joiner) if len(args) > 1 else args[0]
+            args = args[1:]
+    handle.log(level, _caller(), _join_template(str(joiner), len(args)), args, "\n", prefix)
+    if kwargs.get('flush'):
+        handle.flush()
 
 def msg(*args, **kwargs):
     """
@@ -817,6 +1840,7 @@ def err_exit(exitValue, *args, **kwargs):
     args:           see err()
     """
     err(*args, **kwargs)
+    output_flush()
     sys.exit(exitValue)
 
 def err_exit_if(condition, *args, **kwargs):
@@ -834,17 +1858,22 @@ def err_exit_if(condition, *args, **kwargs):
 def verb(*args, **kwargs):
     """
     Print a message if the verbosity level is higher than 0
+    Arguments wrapped with lazy() are only computed if the message is printed.
 
     Parameters:
         args:       see msg()
         kwargs:     see msg()
     """
     if Globals.VERBOSE:
+        kwargs.setdefault('level', 'verbose')
         msg(*args, **kwargs)
+    elif Instrument.enabled:
+        count_suppressed("verb")
 
 def vverb(level, *args, **kwargs):
     """
     Print a message if the verbosity level is higher than the specified level.
+    Arguments wrapped with lazy() are only computed if the message is printed.
 
     Parameters:
         level:int   the debug level required for this message to be printed
@@ -856,7 +1885,10 @@ def vverb(level, *args, **kwargs):
         level = 1
 
     if Globals.VERBOSE >= level:
+        kwargs.setdefault('level', 'verbose')
         msg(*args, **kwargs)
+    elif Instrument.enabled:
+        count_suppressed("vverb")
 
 def verbmsg(*args, **kwargs):
     vverb(1, *args, **kwargs)
@@ -892,25 +1924,133 @@ def usage_msg(*args):
     lines = [munge(line) for line in args ]
     msgx("\n", *lines)
 
+class DebugSite:
+    """
+    A code location which calls dbgmsg() or dbgdump(), and whether its output is enabled.
+    See debug_sites().
+    """
+    __slots__ = ('name', 'prefix', 'enabled')
+
+    def __init__(self, name, prefix, enabled):
+        self.name = name
+        self.prefix = prefix
+        self.enabled = enabled
+
+    def __repr__(self):
+        return f"DebugSite({self.name}, enabled={self.enabled})"
+
+def _debug_site_enabled(name):
+    """
+    Decide whether a debug site is enabled, using the DEBUG_REGEX pattern and then any
+    rules added by debug_site_enable() or debug_site_disable() (the last matching rule wins).
+
+    Parameters:
+        name (str): the site name, "file:func:line"
+
+    Returns:
+        bool: True if the site should print
+    """
+    enabled = Globals.DEBUG_REGEX is None or Globals.DEBUG_REGEX.search(name) is not None
+    for (regex, rule_enabled) in Globals.debug_site_rules:
+        if regex.search(name):
+            enabled = rule_enabled
+    return enabled
+
+def _debug_site(frame):
+    """
+    Return the DebugSite for the code location of a frame.
+    The site (its "prog:file.func:line:" prefix, and whether it is enabled) is resolved once per
+    call site (code object and line) and then cached, so that debug output does not have to
+    walk the stack or read source files, and disabled sites cost a single lookup.
+
+    Parameters:
+        frame (frame): the frame of the caller, ie sys._getframe(1)
+
+    Returns:
+        DebugSite: the site
+    """
+    key = (frame.f_code, frame.f_lineno)
+    site = Globals.callsites.get(key)
+    if site is None:
+        if Globals.callsite_prog is None:
+            Globals.callsite_prog = progname()
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        name = f"{filename}:{code.co_name}:{frame.f_lineno}"
+        prefix = f"{Globals.callsite_prog}:{filename}.{code.co_name}:{frame.f_lineno}:"
+        site = DebugSite(name, prefix, _debug_site_enabled(name))
+        Globals.callsites[key] = site
+    return site
+
+def debug_sites():
+    """
+    Return the debug sites (calls to dbgmsg() or dbgdump()) which have been seen so far.
+
+    Returns:
+        dict: a map of site name ("file:func:line") to a bool indicating whether the site is enabled
+    """
+    return { site.name: site.enabled for site in Globals.callsites.values() }
+
+def _debug_site_rule(pattern, enabled):
+    import re
+    regex = re.compile(pattern)
+    Globals.debug_site_rules.append((regex, enabled))
+    count = 0
+    for site in Globals.callsites.values():
+        if regex.search(site.name):
+            site.enabled = enabled
+            count += 1
+    return count
+
+def debug_site_enable(pattern):
+    """
+    Enable the debug output of sites whose name ("file:func:line") matches a pattern,
+    including sites which have not been reached yet.
+
+    Parameters:
+        pattern (str): a regular expression, searched for in the site names
+
+    Returns:
+        int: the number of already known sites which matched
+    """
+    return _debug_site_rule(pattern, True)
+
+def debug_site_disable(pattern):
+    """
+    Disable the debug output of sites whose name ("file:func:line") matches a pattern,
+    including sites which have not been reached yet.
+
+    Parameters:
+        pattern (str): a regular expression, searched for in the site names
+
+    Returns:
+        int: the number of already known sites which matched
+    """
+    return _debug_site_rule(pattern, False)
+
 def dbgmsg(*args):
     """
     Only if debugging is enabled, print items with debugging info (code location), using msg() for the printing style.
     ie use stringify if necesary.
+    Arguments wrapped with lazy() are only computed if debugging is enabled.
+    The output of each call site can be selected with set_debug_regex() or debug_site_enable().
 
     Parameters:
         args: the items to print
     """
     if Globals.DEBUG:
-        caller = inspect.stack()[1]
-        func = caller.function
-        line = caller.lineno
-        filename = os.path.basename(caller.filename)
-        prog = progname()
-        text = f"{prog}:{filename}.{func}:{line}:" + " ".join([str(x) for x in args])
-        if Globals.DEBUG_REGEX is not None:
-            if not re.match(Globals.DEBUG_REGEX, text):
-                return
-        msg(text)
+        # pylint: disable=protected-access
+        site = _debug_site(sys._getframe(1))
+        if site.enabled:
+            start = perf_counter_ns() if Instrument.enabled else 0
+            text = site.prefix + " ".join([str(_evaluated(x)) for x in args])
+            if start:
+                count_call("dbgmsg", start, encoded_size(text))
+            msg(text, level="debug")
+        elif Instrument.enabled:
+            count_suppressed("dbgmsg")
+    elif Instrument.enabled:
+        count_suppressed("dbgmsg")
 
 def dbgdump(item):
     """
@@ -921,12 +2061,11 @@ def dbgdump(item):
         item: the item to print
     """
     if Globals.DEBUG:
-        caller = inspect.stack()[1]
-        func = caller.function
-        line = caller.lineno
-        filename = os.path.basename(caller.filename)
-        prog = progname()
-        eo(f"{prog}:{filename}.{func}:{line}:" + pformat(item))
+        # pylint: disable=protected-access
+        site = _debug_site(sys._getframe(1))
+        if site.enabled:
+            from pprint import pformat
+            eo(site.prefix + pformat(_evaluated(item)))
 
 
 def read_file(path):
@@ -943,6 +2082,7 @@ def read_file(path):
             return f.read()
     except:
         if Globals.VERBOSE:
+            import traceback
             traceback.print_exc()
         else:
             eo(f"Failed reading file: {path}")
@@ -965,6 +2105,7 @@ def read_file_lines(path):
             return f.readlines()
     except:
         if Globals.VERBOSE:
+            import traceback
             traceback.print_exc()
         else:
             eo(f"Failed reading file: {path}")
@@ -988,6 +2129,7 @@ def write_file(path, contents):
             return True
     except:
         if Globals.VERBOSE:
+            import traceback
             traceback.print_exc()
         else:
             eo(f"Failed writing file: {path}")
@@ -1013,7 +2155,7 @@ def os_path_splitall(path, support_unc=False):
     if path == "":
         return None
 
-    if len(path) > 1 and re.match(r'^[/]{2,}$', path):
+    if len(path) > 1 and not path.strip('/'):
         if support_unc:
             return ['//']
         return ['/']
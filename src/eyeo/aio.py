@@ -0,0 +1,124 @@
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+"""
+Output routines for asyncio programs.
+
+A StreamSink hands the output to an asyncio.StreamWriter instead of blocking on a file,
+and aeo() / amsg() work like eo() / msg() but also wait for the writer to drain when
+its buffer is full, so that a backed-up destination slows the producer down rather than
+stalling the event loop or growing memory without limit.
+
+For example:
+
+    reader, writer = await asyncio.open_connection(host, port)
+    output_add(StreamSink(writer))
+    await amsg("connected to", host)
+    ...
+    output_pop()
+"""
+
+import asyncio
+import threading
+
+from eyeo import eo, msg, output_current
+from eyeo.sinks import Sink
+
+class StreamSink(Sink):
+    """
+    A sink which buffers the written text and passes it to an asyncio.StreamWriter once per
+    event loop iteration, so that all the lines written during one iteration become one write.
+
+    The writer must be created by the event loop which the sink is used with.
+    Text written from other threads is passed to the loop thread safely: the buffer is
+    shared under a lock, and the writer is only used by the loop thread.
+    """
+    def __init__(self, writer, encoding="utf-8", limit=65536):
+        self.writer = writer
+        self.encoding = encoding
+        # buffered text beyond this many characters is passed on without waiting for the next iteration
+        self.limit = limit
+        self.loop = asyncio.get_running_loop()
+        self._buffer = []
+        self._size = 0
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            self._buffer.append(text)
+            self._size += len(text)
+            immediate = self._size >= self.limit
+            schedule = immediate or not self._scheduled
+            self._scheduled = True
+        if schedule:
+            self._schedule(immediate)
+        return len(text)
+
+    def _schedule(self, immediate=False):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self.loop:
+            self.loop.call_soon_threadsafe(self._write_buffer)
+        elif immediate:
+            self._write_buffer()
+        else:
+            self.loop.call_soon(self._write_buffer)
+
+    def _write_buffer(self):
+        # only called in the loop thread, so the writes to the writer stay in order
+        with self._lock:
+            self._scheduled = False
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+        if data:
+            self.writer.write(data.encode(self.encoding))
+
+    def flush(self):
+        """
+        Pass any buffered text to the writer now. This does not wait for it to be sent, see drain().
+        """
+        if self._buffer:
+            self._schedule(immediate=True)
+
+    async def drain(self):
+        """
+        Wait until the writer is ready for more data (see asyncio.StreamWriter.drain()).
+        Text buffered during this iteration is still passed on at the end of the iteration.
+        """
+        await self.writer.drain()
+
+    def close(self):
+        self.flush()
+
+async def output_drain(file=None):
+    """
+    Wait for the current output destination (or the specified one) to accept more data,
+    if it supports that (ie it has a drain() coroutine, like StreamSink).
+
+    Parameters:
+        file: the destination, or None for the current output destination
+    """
+    if file is None:
+        file = output_current()
+    drain = getattr(file, 'drain', None)
+    if drain is not None:
+        await drain()
+
+async def aeo(*args, **kwargs):
+    """
+    Like eo(), and using the same formatting, but then wait for the destination to drain
+    if its buffer is full. See eo() for the parameters.
+    """
+    eo(*args, **kwargs)
+    await output_drain(kwargs.get('file'))
+
+async def amsg(*args, **kwargs):
+    """
+    Like msg(), and using the same formatting, but then wait for the destination to drain
+    if its buffer is full. See msg() for the parameters.
+    """
+    msg(*args, **kwargs)
+    await output_drain(kwargs.get('file'))
@@ -0,0 +1,128 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+__pdoc__ = {
+    'pytest': False
+}
+
+import os
+import sys
+import asyncio
+
+from eyeo import output_add, output_pop, output_buffer, eo, set_rate_limit
+from eyeo.aio import *
+
+class FakeWriter:
+    """ records the writes made to it, and blocks drain() until released """
+    def __init__(self):
+        self.writes = []
+        self.paused = False
+        self.resumed = asyncio.Event()
+    def write(self, data):
+        self.writes.append(data)
+    async def drain(self):
+        if self.paused:
+            await self.resumed.wait()
+
+def test_stream_sink_coalesces_writes(capsys):
+    async def main():
+        writer = FakeWriter()
+        output_add(StreamSink(writer))
+        for i in range(3):
+            await aeo("line", i)
+        await amsg("a", [1, 2])
+        assert not writer.writes
+        await asyncio.sleep(0)
+        output_pop()
+        return writer.writes
+
+    writes = asyncio.run(main())
+    assert writes == [b"line 0\nline 1\nline 2\na [1,2]\n"]
+    assert capsys.readouterr().err == ""
+
+def test_stream_sink_limit():
+    async def main():
+        writer = FakeWriter()
+        sink = StreamSink(writer, limit=10)
+        eo("0123456789", file=sink)
+        assert writer.writes == [b"0123456789\n"]
+        eo("more", file=sink)
+        sink.flush()
+        return writer.writes
+
+    assert asyncio.run(main()) == [b"0123456789\n", b"more\n"]
+
+def test_stream_sink_threads():
+    async def main():
+        writer = FakeWriter()
+        sink = StreamSink(writer, limit=64)
+        def work():
+            for i in range(5000):
+                sink.write(f"t{i}\n")
+        worker = asyncio.get_running_loop().run_in_executor(None, work)
+        for i in range(5000):
+            sink.write(f"m{i}\n")
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        await worker
+        await asyncio.sleep(0)
+        sink.flush()
+        return b"".join(writer.writes).decode().splitlines()
+
+    # switch threads as often as possible, so that writes land part way through passing on the buffer
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        lines = asyncio.run(main())
+    finally:
+        sys.setswitchinterval(interval)
+    assert [ line for line in lines if line[0] == "t" ] == [ f"t{i}" for i in range(5000) ]
+    assert [ line for line in lines if line[0] == "m" ] == [ f"m{i}" for i in range(5000) ]
+
+def test_aeo_backpressure():
+    async def main():
+        writer = FakeWriter()
+        writer.paused = True
+        output_add(StreamSink(writer))
+        task = asyncio.ensure_future(aeo("waiting"))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert not task.done()
+        writer.resumed.set()
+        await task
+        output_pop()
+        return writer.writes
+
+    assert asyncio.run(main()) == [b"waiting\n"]
+
+def test_stream_sink_pipe():
+    async def main(fd):
+        loop = asyncio.get_running_loop()
+        # pylint: disable=consider-using-with
+        pipe = open(fd, "wb", buffering=0)
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, pipe)
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        output_add(StreamSink(writer))
+        await amsg("through", "a pipe")
+        await aeo("done")
+        output_pop()
+        await writer.drain()
+        writer.close()
+
+    (rfd, wfd) = os.pipe()
+    asyncio.run(main(wfd))
+    with open(rfd, "rb") as pipe:
+        assert pipe.read() == b"through a pipe\ndone\n"
+
+def test_rate_limit_call_sites():
+    async def main():
+        for _ in range(3):
+            await amsg("first", rate="1/min")
+            await amsg("second", rate="1/min")
+    buf = output_buffer()
+    try:
+        asyncio.run(main())
+    finally:
+        output_pop()
+        set_rate_limit(None)
+    assert buf.getvalue() == "first\nsecond\n"
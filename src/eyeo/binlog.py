@@ -0,0 +1,348 @@
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+"""
+A binary log format for the highest rate output, where the text is only formatted later by a decoder.
+
+A BinlogSink on the output stack (see eyeo.output_binlog()) receives the format string, call site
+and arguments of each call of eo() and the msg() family, instead of the formatted text. The first
+time a (call site, format string, level, prefix, end) combination is seen, it is written once as a definition
+with an integer id, and from then on each call writes only:
+
+    the id, the time, and the arguments packed with struct
+
+Arguments which are bool, int, float, str, bytes or None are written as they are (ints beyond
+64 bits as text), and other values are converted with stringify() (as msg() would), so the
+formatting of complex values is still done at the call. Calls of eo() with formatting options
+(eg indent, fmt or style) are formatted at the call, and written as a single text argument.
+
+The log is decoded with:
+
+    python -m eyeo.binlog [--format text|jsonl|logfmt] [--timestamps] file...
+
+The text format prints the messages as eo() and msg() would have, except that complex items
+passed to eo() are shown with stringify() rather than str(). The jsonl and logfmt formats are
+those of eyeo.structured.
+
+File format (little endian):
+    header:     b"\\x89EYEO01\\n"; the ids of the records which follow start again
+    definition: b"D", id (uint32), length (uint32), then utf-8 "level\\0site\\0prefix\\0end\\0format"
+    entry:      b"E", id (uint32), time (float64, seconds since the epoch), count (uint32),
+                the type code of each argument (a byte each), the fixed size value of each argument,
+                and then the data of the str, bytes and o arguments. The type codes and values are:
+                    N: None (no value), ?: bool, i: int64, d: float64,
+                    s: utf-8 str, b: bytes, o: utf-8 stringify() text (with a uint32 length as the value)
+
+Each combination of argument types is packed with a single precompiled struct.Struct.
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+import threading
+
+from eyeo.sinks import Sink, _register
+from eyeo.stringify import stringify_value
+
+MAGIC = b"\x89EYEO01\n"
+
+_DEFINITION = struct.Struct("<cII")
+_DEFINITION_BODY = struct.Struct("<II")
+_ENTRY_BODY = struct.Struct("<IdI")
+
+# the type code, struct format and kind of each argument type:
+#   v: the value is packed as it is, n: nothing is packed, s/b/o: the value is converted
+#   to str (with stringify() for o) or bytes, and its length is packed, with the data after the fixed size values
+_TYPES = {
+    str: (b"s", "I", "s"),
+    int: (b"i", "q", "v"),
+    float: (b"d", "d", "v"),
+    bool: (b"?", "?", "v"),
+    type(None): (b"N", "", "n"),
+    bytes: (b"b", "I", "b"),
+}
+_OTHER = (b"o", "I", "o")
+
+class _Plans:
+    """ Scoping class for the compiled packing of each combination of argument types """
+    # pylint: disable=too-few-public-methods
+    entries = {}
+    decoders = {}
+    limit = 1024
+
+def _entry_plan(types):
+    """
+    Return (Struct, codes, kinds, direct) for packing the entries with arguments of some types,
+    where direct is True if the arguments can be passed to pack() as they are.
+    """
+    plan = _Plans.entries.get(types)
+    if plan is None:
+        found = [ _TYPES.get(t, _OTHER) for t in types ]
+        codes = b"".join([ f[0] for f in found ])
+        kinds = "".join([ f[2] for f in found ])
+        packer = struct.Struct(f"<cIdI{len(codes)}s" + "".join([ f[1] for f in found ]))
+        plan = (packer, codes, kinds, not kinds.strip("v"))
+        if len(_Plans.entries) >= _Plans.limit:
+            _Plans.entries.clear()
+        _Plans.entries[types] = plan
+    return plan
+
+def _decode_plan(codes):
+    """
+    Return (Struct, kinds) for unpacking the fixed size values of the arguments with some type codes.
+    """
+    plan = _Plans.decoders.get(codes)
+    if plan is None:
+        found = []
+        for code in codes:
+            for (c, fmt, kind) in list(_TYPES.values()) + [_OTHER]:
+                if c[0] == code:
+                    found.append((fmt, kind))
+                    break
+            else:
+                raise DecodeError(f"unknown argument type {bytes([code])!r}")
+        plan = (struct.Struct("<" + "".join([ f[0] for f in found ])), "".join([ f[1] for f in found ]))
+        if len(_Plans.decoders) >= _Plans.limit:
+            _Plans.decoders.clear()
+        _Plans.decoders[codes] = plan
+    return plan
+
+def _pack_entry(ident, now, args):
+    """
+    Return an entry, see the module documentation.
+    """
+    (packer, codes, kinds, direct) = _entry_plan(tuple(map(type, args)))
+    if direct:
+        return packer.pack(b"E", ident, now, len(args), codes, *args)
+    values = []
+    datas = []
+    for (v, kind) in zip(args, kinds):
+        if kind == "v":
+            values.append(v)
+        elif kind != "n":
+            if kind == "s":
+                data = v.encode("utf-8", "surrogatepass")
+            elif kind == "b":
+                data = v
+            else:
+                data = stringify_value(v, 3, 6, 400).encode("utf-8", "surrogatepass")
+            values.append(len(data))
+            datas.append(data)
+    return packer.pack(b"E", ident, now, len(args), codes, *values) + b"".join(datas)
+
+class BinlogSink(Sink):
+    """
+    A sink which writes the binary log format, see the module documentation.
+    The output routines pass each call to log() rather than formatting it. Text written by
+    other means (eg pretty_to(), or eo() with formatting options such as indent) is logged
+    as an already formatted message.
+
+    The data is buffered, and written when buffer_size bytes are buffered, on flush()
+    (eg by output_pop()) and at exit. After a fork, the child should add its own BinlogSink
+    (to its own file), as the ids written by the parent are not known to it.
+
+    Parameters:
+        target (str|file): a path, which is created (or truncated), or a file opened in binary mode
+        buffer_size (int): the number of bytes to buffer before writing
+    """
+    records = True
+    deferred = True
+
+    def __init__(self, target, buffer_size=65536):
+        if isinstance(target, (str, bytes, os.PathLike)):
+            # pylint: disable=consider-using-with
+            target = open(target, "wb")
+            self._owned = True
+        else:
+            self._owned = False
+        self.fhandle = target
+        self.buffer_size = buffer_size
+        self.ids = {}
+        self._lock = threading.Lock()
+        # held from taking the buffer until it is written, so that concurrent flushes keep the order
+        self._write_lock = threading.Lock()
+        self._buffer = bytearray(MAGIC)
+        _register(self)
+
+    def _define(self, key, level, site, fmt, end, prefix):
+        with self._lock:
+            found = self.ids.get(key)
+            if found is None:
+                if not isinstance(site, str):
+                    site = f"{os.path.basename(site[0].co_filename)}:{site[1]}"
+                found = len(self.ids)
+                data = f"{level}\0{site}\0{prefix}\0{end}\0{fmt}".encode("utf-8", "surrogatepass")
+                self._buffer += _DEFINITION.pack(b"D", found, len(data))
+                self._buffer += data
+                self.ids[key] = found
+        return found
+
+    def log(self, level, site, fmt, args, end="\n", prefix=""):
+        """
+        Write an entry.
+
+        Parameters:
+            level (str): the level, see eyeo.structured
+            site (tuple|str): the call site, as (code, line number) or a name
+            fmt (str): the str.format() template of the message, with a "{}" for each argument
+            args (list|tuple): the arguments
+            end (str): the text printed after the message, as the eo() end option
+            prefix (str): the text printed before the message, eg "WARNING: " (which is not part of
+                the message of a structured record)
+        """
+        key = (site, fmt, level, end, prefix)
+        ident = self.ids.get(key)
+        if ident is None:
+            ident = self._define(key, level, site, fmt, end, prefix)
+        try:
+            data = _pack_entry(ident, time.time(), args)
+        except struct.error:
+            # an int which does not fit in 64 bits
+            data = _pack_entry(ident, time.time(), [ str(v) if type(v) is int else v for v in args ])
+        with self._lock:
+            self._buffer += data
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def emit(self, level, site, message, args):
+        # an already formatted message, see eyeo.structured.RecordSink. The arguments are part of
+        # the RecordSink interface, but are not logged, as the message already includes them
+        # pylint: disable=unused-argument
+        self.log(level, site, "{}", (message,))
+
+    def write(self, text):
+        message = text.rstrip("\n")
+        if text:
+            self.log("info", "", "{}", (message,), text[len(message):])
+        return len(text)
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                data = bytes(self._buffer)
+                self._buffer.clear()
+            if data:
+                self.fhandle.write(data)
+            self.fhandle.flush()
+
+    def close(self):
+        self.flush()
+        if self._owned:
+            self.fhandle.close()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._buffer.clear()
+
+class DecodeError(Exception):
+    """ The data is not in the binary log format """
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise DecodeError(f"truncated log, expected {size} bytes and found {len(data)}")
+    return data
+
+def _unpack_args(f, count):
+    (unpacker, kinds) = _decode_plan(_read(f, count))
+    values = iter(unpacker.unpack(_read(f, unpacker.size)))
+    args = []
+    for kind in kinds:
+        if kind == "v":
+            args.append(next(values))
+        elif kind == "n":
+            args.append(None)
+        else:
+            data = _read(f, next(values))
+            args.append(data if kind == "b" else data.decode("utf-8", "surrogatepass"))
+    return args
+
+def _format(fmt, args):
+    """
+    Return the message of an entry, or its template and arguments if they do not match,
+    eg a definition written by a different version of the program.
+    """
+    try:
+        return fmt.format(*args)
+    except (IndexError, KeyError, ValueError, TypeError, AttributeError):
+        return f"{fmt} {args!r}"
+
+def decode(f):
+    """
+    Read a binary log.
+
+    Parameters:
+        f (file): the log, opened in binary mode
+
+    Yields:
+        tuple(float, str, str, str, list, str): the time, level, call site, formatted message and
+        arguments of each entry, and its text as the output routines would have printed it
+        (with the level prefix and line ending)
+
+    Raises:
+        DecodeError: if the data is not a binary log
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise DecodeError("not an eyeo binary log")
+    definitions = {}
+    while True:
+        tag = f.read(1)
+        if not tag:
+            return
+        if tag == b"E":
+            (ident, when, count) = _ENTRY_BODY.unpack(_read(f, _ENTRY_BODY.size))
+            args = _unpack_args(f, count)
+            try:
+                (level, site, prefix, end, fmt) = definitions[ident]
+            except KeyError:
+                raise DecodeError(f"entry for undefined id {ident}") from None
+            message = _format(fmt, args)
+            yield (when, level, site, message, args, prefix + message + end)
+        elif tag == b"D":
+            (ident, size) = _DEFINITION_BODY.unpack(_read(f, _DEFINITION_BODY.size))
+            fields = _read(f, size).decode("utf-8", "surrogatepass").split("\0", 4)
+            if len(fields) != 5:
+                raise DecodeError(f"corrupt definition of id {ident}")
+            definitions[ident] = tuple(fields)
+        elif tag == MAGIC[:1]:
+            # another session appended to the same file
+            if _read(f, len(MAGIC) - 1) != MAGIC[1:]:
+                raise DecodeError("corrupt log header")
+            definitions = {}
+        else:
+            raise DecodeError(f"unknown record type {tag!r}")
+
+def main(argv=None):
+    from eyeo.structured import ENCODERS, timestamp
+    parser = argparse.ArgumentParser(prog="python -m eyeo.binlog", description="Decode eyeo binary logs")
+    parser.add_argument("files", nargs="+", metavar="FILE", help="the logs to decode (- for stdin)")
+    parser.add_argument("-f", "--format", choices=("text",) + tuple(ENCODERS), default="text",
+                        help="print the messages as text (default), or as jsonl or logfmt records")
+    parser.add_argument("-t", "--timestamps", action="store_true", help="prefix the text with the time and call site")
+    options = parser.parse_args(argv)
+
+    out = sys.stdout
+    encode = ENCODERS.get(options.format)
+    for path in options.files:
+        # pylint: disable=consider-using-with
+        f = sys.stdin.buffer if path == "-" else open(path, "rb")
+        try:
+            for (when, level, site, message, args, text) in decode(f):
+                if encode is not None:
+                    out.write(encode(level, site, message, args, now=when))
+                elif options.timestamps:
+                    out.write(f"{timestamp(when)} {site}: {text}")
+                else:
+                    out.write(text)
+        except DecodeError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            return 1
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+__pdoc__ = {
+    'pytest': False
+}
+
+import os
+import sys
+import json
+import subprocess
+import threading
+import time
+from io import BytesIO
+
+import pytest
+
+from eyeo import eo, msg, msgx, warn, err, set_debug, dbgmsg, output_binlog, output_buffer, output_pop, lazy, current_line_number
+from eyeo.binlog import *
+
+def logged(func):
+    """ run func with the output going to a binary log, and return the decoded entries """
+    buf = BytesIO()
+    output_binlog(buf)
+    try:
+        func()
+    finally:
+        output_pop()
+    buf.seek(0)
+    return list(decode(buf))
+
+def test_binlog_matches_text():
+    def calls():
+        warn("retry", 1, 2.5, None, True, [1, 2], {"a": 1}, b"raw")
+        err("failed", "x" * 500)
+        msg("big", 1 << 70, -(1 << 63), float("inf"))
+        eo("done {} of {}", 2, 3)
+        eo("plain", None, 7, joiner=", ")
+        eo([1, "two", 3.0])
+        eo("a", "b", indent="  ")
+        eo("lazy", lazy(lambda: 42))
+        msgx("}{", "braces {}", "{x}")
+        eo("part", end="")
+        eo("rest")
+    text = output_buffer()
+    try:
+        calls()
+    finally:
+        output_pop()
+    entries = logged(calls)
+    assert "".join(e[5] for e in entries) == text.getvalue()
+    assert [ level for (_, level, _, _, _, _) in entries ] == [ "warning", "error", "info", "info", "info", "info", "info", "info", "info", "info", "info" ]
+    assert entries[0][3].startswith("retry 1 2.5 None")
+    assert entries[0][4] == [ "retry", 1, 2.5, None, True, "[1,2]", "{a=1}", b"raw" ]
+    assert entries[3][4] == [ 2, 3 ]
+
+def test_binlog_interning():
+    lines = []
+    def calls():
+        lines.append(current_line_number() + 2)
+        for i in range(100):
+            eo("item {}", i)
+        set_debug(1)
+        dbgmsg("debug", 1)
+        set_debug(0)
+    buf = BytesIO()
+    output_binlog(buf)
+    calls()
+    output_pop()
+    data = buf.getvalue()
+    assert data.startswith(MAGIC)
+    assert data.count(b"item {}") == 1
+    buf.seek(0)
+    entries = list(decode(buf))
+    assert len(entries) == 101
+    assert entries[99][3] == "item 99" and entries[99][2] == f"binlog_test.py:{lines[0]}"
+    assert entries[100][1] == "debug"
+
+def test_binlog_sessions(tmp_path):
+    path = tmp_path / "log.bin"
+    output_binlog(str(path))
+    eo("first {}", 1)
+    output_pop()
+    data = path.read_bytes()
+    output_binlog(str(path))
+    eo("second {}", 2)
+    output_pop()
+    with open(path, "rb") as f:
+        assert [ e[3] for e in decode(f) ] == [ "second 2" ]
+    with open(path, "ab") as f:
+        f.write(data)
+    with open(path, "rb") as f:
+        assert [ e[3] for e in decode(f) ] == [ "second 2", "first 1" ]
+
+def test_decode_errors():
+    with pytest.raises(DecodeError):
+        list(decode(BytesIO(b"not a log")))
+    buf = BytesIO()
+    sink = BinlogSink(buf)
+    sink.log("info", "site", "{} {}", [1, "two"])
+    sink.flush()
+    with pytest.raises(DecodeError):
+        list(decode(BytesIO(buf.getvalue()[:-2])))
+
+def test_decode_bad_template():
+    buf = BytesIO()
+    sink = BinlogSink(buf)
+    sink.log("info", "site", "{name} {}", [1])
+    sink.log("info", "site", "{} {}", [1])
+    sink.log("info", "site", "{:d}", ["text"])
+    sink.log("info", "site", "ok {}", [2])
+    sink.flush()
+    buf.seek(0)
+    assert [ e[3] for e in decode(buf) ] == [ "{name} {} [1]", "{} {} [1]", "{:d} ['text']", "ok 2" ]
+
+class SlowFile(BytesIO):
+    """ a file whose writes let other threads run part way through """
+    def write(self, data):
+        middle = len(data) // 2
+        super().write(data[:middle])
+        time.sleep(0.0001)
+        return super().write(data[middle:])
+
+def test_binlog_threads():
+    buf = SlowFile()
+    sink = BinlogSink(buf, buffer_size=64)
+    def run(n):
+        for i in range(500):
+            sink.log("info", f"thread{n}", "{} {}", [n, i])
+    threads = [ threading.Thread(target=run, args=(n,)) for n in range(4) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sink.flush()
+    buf.seek(0)
+    entries = list(decode(buf))
+    assert len(entries) == 2000
+    for n in range(4):
+        assert [ e[4][1] for e in entries if e[4][0] == n ] == list(range(500))
+
+def test_decoder_main(tmp_path, capsys):
+    path = tmp_path / "log.bin"
+    output_binlog(str(path))
+    warn("disk", 93.5, "full")
+    output_pop()
+    def run(*options):
+        assert main([*options, str(path)]) == 0
+        return capsys.readouterr().out
+    assert run() == "WARNING: disk 93.5 full\n"
+    record = json.loads(run("--format", "jsonl"))
+    assert (record["level"], record["msg"], record["args"]) == ("warning", "disk 93.5 full", ["disk", 93.5, "full"])
+    assert run("-f", "logfmt").split(" level=")[1].startswith("warning site=binlog_test.py:")
+    assert run("-t").endswith(": WARNING: disk 93.5 full\n")
+    (tmp_path / "bad.bin").write_bytes(b"not a log")
+    assert main([str(tmp_path / "bad.bin")]) == 1
+    assert "not an eyeo binary log" in capsys.readouterr().err
+
+def test_decoder_module(tmp_path):
+    path = tmp_path / "log.bin"
+    output_binlog(str(path))
+    eo("run as {}", "a module")
+    output_pop()
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-m", "eyeo.binlog", str(path)], capture_output=True, text=True, check=True, env=env)
+    assert result.stdout == "run as a module\n"
@@ -5,6 +5,13 @@ __pdoc__ = {
     'pytest': False
 }
 
+import sys
+import time
+import asyncio
+import threading
+import subprocess
+import concurrent.futures
+
 import pytest
 
 import eyeo
@@ -54,17 +61,25 @@ def test__init_level():
     os.environ[key] = "5"
     assert eyeo._init_level(key, 0) == 5
 
+def _debug_selected():
+    dbgmsg("should show TEST A")
+
+def _debug_other():
+    dbgmsg("should not show this")
+
 def test_set_debug_regex(capsys):
-    set_debug_regex(".*TEST.*")
+    set_debug_regex(".*_debug_selected.*")
     set_debug(1)
-    dbgmsg("should not show this")
-    dbgmsg("should show TEST A")
-    dbgmsg("should not show this either")
-    dbgmsg("should show TEST B")
+    _debug_other()
+    _debug_selected()
+    _debug_other()
+    _debug_selected()
+    set_debug_regex(None)
+    set_debug(0)
     result = capsys.readouterr().err.splitlines()
     assert len(result) == 2
     assert result[0].endswith("should show TEST A")
-    assert result[1].endswith("should show TEST B")
+    assert result[1].endswith("should show TEST A")
 
 def test_increment_debug():
     set_debug(0)
@@ -124,6 +139,118 @@ def test_output_buffer(capsys):
     msg("this goes to stderr")
     assert capsys.readouterr().err == "this goes to stderr\n"
 
+def test_output_background(capsys):
+    buf = StringIO()
+    writer = output_background(buf, maxsize=4)
+    for i in range(10):
+        msg("line", i)
+    output_flush()
+    assert buf.getvalue() == "".join(f"line {i}\n" for i in range(10))
+    msg("last line")
+    (popped, _, _) = output_pop()
+    assert popped is writer
+    assert writer.closed
+    assert buf.getvalue().endswith("line 9\nlast line\n")
+    assert capsys.readouterr().err == ""
+
+def test_output_sinks(capsys):
+    sink = output_add(StringSink())
+    msg("captured", 1)
+    (popped, buflen, bufdata) = output_pop()
+    assert popped is sink
+    assert bufdata == "captured 1\n"
+    assert buflen == len(bufdata)
+
+    buf = StringIO()
+    output_add(FileSink(buf, buffer_size=1024))
+    eo("buffered")
+    assert buf.getvalue() == ""
+    eo("flushed", flush=True)
+    assert buf.getvalue() == "buffered\nflushed\n"
+    eo("popped")
+    output_pop()
+    assert buf.getvalue() == "buffered\nflushed\npopped\n"
+    assert capsys.readouterr().err == ""
+
+def test_output_null_sink(capsys):
+    calls = []
+    output_add(NullSink())
+    msg("discarded", lazy(calls.append, 1))
+    eo("discarded {}", lazy(calls.append, 2))
+    output_pop()
+    assert not calls
+    assert capsys.readouterr().err == ""
+
+def test_err_exit_flushes_background_output():
+    buf = StringIO()
+    output_background(buf)
+    with pytest.raises(SystemExit):
+        err_exit(2, "stopping")
+    assert buf.getvalue() == "ERROR: stopping\n"
+    output_pop()
+
+def _capture_in_context(i, pause):
+    buf = output_buffer()
+    for j in range(5):
+        msg("worker", i, "line", j)
+        pause()
+    (popped, _, data) = output_pop()
+    assert popped is buf
+    return data
+
+def test_output_stack_per_thread(capsys):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: _capture_in_context(i, lambda: time.sleep(0.001)), range(16)))
+    for i, data in enumerate(results):
+        assert data == "".join(f"worker {i} line {j}\n" for j in range(5))
+    assert capsys.readouterr().err == ""
+    assert output_current() is sys.stderr
+
+def test_output_stack_reaches_threads(capsys):
+    buf = output_buffer()
+    try:
+        worker = threading.Thread(target=lambda: msg("from thread", 1))
+        worker.start()
+        worker.join()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda i: eo("from pool", i), range(2)))
+        # a thread's own captures do not affect the others, and it falls back to the main stack after them
+        def capture():
+            inner = output_buffer()
+            eo("captured")
+            output_pop()
+            eo("after capture")
+            return inner.getvalue()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            captured = pool.submit(capture).result()
+    finally:
+        output_pop()
+    assert sorted(buf.getvalue().splitlines()) == ["after capture", "from pool 0", "from pool 1", "from thread 1"]
+    assert captured == "captured\n"
+    assert capsys.readouterr().err == ""
+
+def test_output_stack_per_task(capsys):
+    async def capture(i):
+        buf = output_buffer()
+        for j in range(5):
+            msg("task", i, "line", j)
+            await asyncio.sleep(0)
+        (popped, _, data) = output_pop()
+        assert popped is buf
+        return data
+
+    async def main():
+        return await asyncio.gather(*[ capture(i) for i in range(8) ])
+
+    outer = output_buffer()
+    results = asyncio.run(main())
+    msg("outer")
+    assert output_pop()[0] is outer
+    assert outer.getvalue() == "outer\n"
+    for i, data in enumerate(results):
+        assert data == "".join(f"task {i} line {j}\n" for j in range(5))
+    assert capsys.readouterr().err == ""
+
 # this one tested by test_output_buffer
 def test_output_pop():
     msg("Unimplemented test")
@@ -160,6 +287,155 @@ def test_eocmd(capsys):
 def test_pretty(capsys):
     assert capsys.readouterr().err == ""
 
+class CountingBuffer(StringIO):
+    """ a string buffer which counts the writes it receives """
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+def test_pretty_to():
+    data = {"b": [1, 2], "a": None}
+    buf = StringIO()
+    pretty_to(buf, data)
+    assert buf.getvalue() == pretty(data) == '{\n    "a" : null, \n    "b" : [\n        1, \n        2\n    ]\n}'
+
+def test_eo_json_stream():
+    buf = CountingBuffer()
+    eo({"a": 1}, [2], None, style="json", file=buf)
+    assert buf.getvalue() == pretty({"a": 1}) + " " + pretty([2]) + " (None)\n"
+    assert buf.writes == 1
+
+    big = { f"k{i}": list(range(20)) for i in range(2000) }
+    buf = CountingBuffer()
+    eo(big, style="json", file=buf)
+    assert buf.getvalue() == pretty(big) + "\n"
+    assert 1 < buf.writes <= len(buf.getvalue()) // 65536 + 2
+
+def test_eo_stringify_stream(monkeypatch):
+    buf = CountingBuffer()
+    eo((1, "a"), [2, "x"], None, style="stringify", file=buf)
+    assert (buf.getvalue(), buf.writes) == ("[1,a] [2,x] (None)\n", 1)
+
+    monkeypatch.setattr(eyeo.Globals, "stream_chunk", 64)
+    big = { f"k{i}": list(range(20)) for i in range(20) }
+    buf = CountingBuffer()
+    eo(big, style="stringify", file=buf)
+    assert buf.getvalue() == stringify_value(big) + "\n"
+    assert buf.writes > 1
+
+def test_msgx_stream(monkeypatch):
+    buf = CountingBuffer()
+    msgx(", ", "a", None, lazy(lambda: [1, 2]), {"k": "v", "j": 1}, 2.5, file=buf)
+    assert (buf.getvalue(), buf.writes) == ("a, None, [1,2], {j=1,k=v}, 2.5\n", 1)
+    msgx("-", "x", list(range(10)), file=buf, end="|")
+    assert buf.getvalue().endswith("\nx-[0,1,2,3,4,5,...(+4 items)]|")
+
+    monkeypatch.setattr(eyeo.Globals, "stream_chunk", 16)
+    buf = CountingBuffer()
+    msg("items", [ "item" * 10 ] * 6, file=buf)
+    assert buf.getvalue() == "items " + stringify_value([ "item" * 10 ] * 6, 3, 6, 400) + "\n"
+    assert buf.writes > 1
+
+def run_python(code, *options, **env):
+    """ run some python code in a new interpreter which imports eyeo from this tree, and return its stdout and stderr """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(eyeo.__file__)), **env)
+    res = subprocess.run([sys.executable, *options, "-c", code], env=env, check=True, capture_output=True, text=True)
+    return res.stdout if not options else (res.stdout, res.stderr)
+
+def test_import_deferred_modules():
+    heavy = ('re', 'json', 'logging', 'traceback', 'pprint', 'inspect', 'yaml')
+    code = f"import sys; before = set(sys.modules); import eyeo; print([ m for m in {heavy} if m in sys.modules and m not in before ])"
+    assert run_python(code) == "[]\n"
+    # but they are still available as attributes
+    assert eyeo.json.dumps([1]) == "[1]"
+
+def test_import_time(tmp_path):
+    # the import time budget for eyeo (including its own imports), in microseconds
+    budget = int(os.environ.get("EYEO_IMPORT_BUDGET_US", "50000"))
+    env = { "PYTHONPYCACHEPREFIX": str(tmp_path), "PYTHONDONTWRITEBYTECODE": "" }
+    # the first run compiles the modules
+    run_python("import eyeo", "-X", "importtime", **env)
+    (_, report) = run_python("import eyeo", "-X", "importtime", **env)
+    cumulative = [ int(line.split("|")[1]) for line in report.splitlines() if line.endswith("| eyeo") ]
+    assert cumulative and cumulative[0] < budget
+
+def test_yaml_lazy_import():
+    assert run_python("import sys, eyeo; print('yaml' in sys.modules)") == "False\n"
+    assert run_python("import sys, eyeo; eyeo.pretty({}, style='yaml'); print('yaml' in sys.modules)") == "True\n"
+
+def test_pretty_yaml():
+    class Obj:
+        # pylint: disable=too-few-public-methods
+        def __init__(self):
+            self.a = 1
+    assert pretty({"b": [1], "a": None}, style="yaml") == "a: null\nb:\n- 1\n"
+    assert pretty({"t": (1, "x")}, style="yaml") == "t: !!python/tuple\n- 1\n- x\n"
+    # a document which is a single plain scalar has an end marker, as before libyaml was used
+    assert [ pretty(v, style="yaml") for v in ("b c", 5, None, "a: b") ] == [ "b c\n...\n", "5\n...\n", "null\n...\n", "'a: b'\n" ]
+    # objects cannot be represented by the safe dumper
+    assert pretty(Obj(), style="yaml").endswith("Obj\na: 1\n")
+
+def test_pretty_yaml_missing(capsys, monkeypatch):
+    monkeypatch.setattr(eyeo.Globals, "yaml", eyeo.FakeYaml)
+    monkeypatch.setattr(eyeo.FakeYaml, "warned", False)
+    assert pretty({"b": 1, "a": 2}, style="yaml", indent=0) == '{\n"a": 2,\n"b": 1\n}'
+    pretty({}, style="yaml")
+    assert capsys.readouterr().err == "Warning - no yaml support - falling back to json format\n"
+
+def test_pretty_numpy():
+    np = pytest.importorskip("numpy")
+    text = pretty({"a": np.arange(10), "b": np.float64(1.5)}, indent=0)
+    assert text == '{\n"a" : "ndarray{shape=10,dtype=int64,min=0,max=9,mean=4.5,data=[0,1,2,...(+4 items),7,8,9]}", \n"b" : 1.5\n}'
+
+class FakeNumpy:
+    """ enough of numpy for ndarray_summary(), so that the numpy support is tested without it """
+    # pylint: disable=too-few-public-methods
+    class Flat:
+        def __init__(self, values):
+            self.values = values
+        def __getitem__(self, index):
+            return FakeNumpy.Flat(self.values[index])
+        def tolist(self):
+            return list(self.values)
+
+    class ndarray:
+        def __init__(self, values):
+            self.values = values
+            self.size = len(values)
+            self.shape = (len(values),)
+            self.dtype = "int64"
+            self.flat = FakeNumpy.Flat(values)
+        def min(self):
+            return min(self.values)
+        def max(self):
+            return max(self.values)
+        def mean(self):
+            return sum(self.values) / len(self.values)
+
+    class generic:
+        def __init__(self, value):
+            self.value = value
+        def item(self):
+            return self.value
+
+    integer = "int"
+    floating = "float"
+
+    @staticmethod
+    def issubdtype(dtype, kind):
+        return dtype.startswith(kind)
+
+def test_pretty_fake_numpy(monkeypatch):
+    monkeypatch.setitem(sys.modules, "numpy", FakeNumpy)
+    data = {"a": FakeNumpy.ndarray(list(range(10))), "b": FakeNumpy.generic(1.5)}
+    summary = "ndarray{shape=10,dtype=int64,min=0,max=9,mean=4.5,data=[0,1,2,...(+4 items),7,8,9]}"
+    assert pretty(data, indent=0) == '{\n"a" : "' + summary + '", \n"b" : 1.5\n}'
+    if eyeo.yaml is not eyeo.FakeYaml:
+        assert pretty(data, style="yaml") == f"a: {summary}\nb: 1.5\n"
+
 def test_eo(capsys):
     assert capsys.readouterr().err == ""
 
@@ -167,6 +443,38 @@ def test_eo_firstformat(capsys):
     eo("This {} an {}.", "is", "example")
     assert capsys.readouterr().err == endl("This is an example.")
 
+def test_eo_style(capsys):
+    eo("a", [1, "b"], style="repr")
+    assert capsys.readouterr().err == "'a' [1, 'b']\n"
+    eo([[1, 2], {"b": 1}], style="stringify")
+    assert capsys.readouterr().err == "[1,2] {...(+2 items)}\n"
+
+def test_printer(capsys):
+    p = printer(indent="  ")
+    p("a", "b c")
+    p(1, None)
+    assert capsys.readouterr().err == "  a\n  b c\n  1\n(None)\n"
+
+    p = printer(quote_if="s")
+    p("a", "b c")
+    assert capsys.readouterr().err == "a 'b c'\n"
+
+    buf = StringIO()
+    p = printer(file=buf, joiner=",", end=";")
+    p("x", "y")
+    p("{}")
+    assert buf.getvalue() == "x,y;{};"
+
+    p = printer()
+    p("The {} is {}", "answer", 42)
+    p("Not a {} format")
+    assert capsys.readouterr().err == "The answer is 42\nNot a {} format\n"
+
+def test__printer():
+    # pylint: disable=protected-access
+    assert eyeo._printer(joiner=",") is eyeo._printer(joiner=",")
+    assert eyeo._printer(joiner=",") is not eyeo._printer(joiner=";")
+
 def test_eod(capsys):
     assert capsys.readouterr().err == ""
 
@@ -262,6 +570,38 @@ def test_vverb(capsys):
     vverb(4, "should not print 4")
     assert capsys.readouterr().err == ""
 
+def test_lazy(capsys, monkeypatch):
+    calls = []
+    def expensive(x):
+        calls.append(x)
+        return {"x": x}
+    stringified = []
+    original_stringify_to = eyeo.stringify_to
+    def counting_stringify_to(stream, *args):
+        stringified.append(args)
+        return original_stringify_to(stream, *args)
+    monkeypatch.setattr(eyeo, "stringify_to", counting_stringify_to)
+
+    set_verbose(0)
+    set_debug(0)
+    verb("state:", lazy(expensive, 1))
+    vverb(1, "state:", lazy(expensive, 2))
+    dbgmsg("state:", lazy(expensive, 3))
+    dbgdump(lazy(expensive, 4))
+    assert not calls
+    assert not stringified
+    assert capsys.readouterr().err == ""
+
+    set_verbose(1)
+    verb("state:", lazy(expensive, 5), lazy("{} of {}", 1, 2))
+    set_verbose(0)
+    assert calls == [5]
+    assert len(stringified) == 3
+    assert capsys.readouterr().err == "state: {x=5} 1 of 2\n"
+
+    eo(lazy("{a}-{b}", a=1, b=2), lazy(lambda: None))
+    assert capsys.readouterr().err == "1-2 (None)\n"
+
 def test_dbgexit(capsys):
     with pytest.raises(SystemExit):
         dbgexit("blah")
@@ -271,10 +611,67 @@ def test_usage_msg(capsys):
     assert capsys.readouterr().err == ""
 
 def test_dbgmsg(capsys):
+    set_debug_regex(None)
+    set_debug(0)
+    dbgmsg("not shown")
     assert capsys.readouterr().err == ""
 
+    set_debug(1)
+    for i in range(2):
+        dbgmsg("shown", i)
+    result = capsys.readouterr().err.splitlines()
+    set_debug(0)
+    prefix = f"{progname()}:eyeo_test.py.test_dbgmsg:"
+    assert len(result) == 2
+    assert result[0].startswith(prefix) and result[0].endswith(":shown 0")
+    assert result[1].startswith(prefix) and result[1].endswith(":shown 1")
+    # both messages came from the same call site, so share the cached prefix
+    assert result[0][:-1] == result[1][:-1]
+
 def test_dbgdump(capsys):
-    assert capsys.readouterr().err == ""
+    set_debug(1)
+    dbgdump({"a": 1})
+    result = capsys.readouterr().err
+    set_debug(0)
+    assert result.startswith(f"{progname()}:eyeo_test.py.test_dbgdump:")
+    assert result.endswith(":{'a': 1}\n")
+
+def test__debug_site():
+    # pylint: disable=protected-access
+    def where():
+        return eyeo._debug_site(sys._getframe(1))
+    sites = []
+    for _ in range(2):
+        sites.append(where())
+    line = current_line_number() - 1
+    assert sites[0].name == f"eyeo_test.py:test__debug_site:{line}"
+    assert sites[0].prefix == f"{progname()}:eyeo_test.py.test__debug_site:{line}:"
+    assert sites[1] is sites[0]
+
+def test_debug_sites(capsys):
+    set_debug_regex(None)
+    set_debug(1)
+    _debug_other()
+    _debug_selected()
+    sites = debug_sites()
+    other = [ name for name in sites if ":_debug_other:" in name ]
+    assert len(other) == 1
+    assert sites[other[0]] is True
+
+    assert debug_site_disable(":_debug_other:") == 1
+    assert debug_sites()[other[0]] is False
+    _debug_other()
+    _debug_selected()
+    assert debug_site_enable(other[0]) == 1
+    _debug_other()
+    set_debug(0)
+    result = capsys.readouterr().err.splitlines()
+    assert [ line.split(":")[-1] for line in result ] == [
+        "should not show this",
+        "should show TEST A",
+        "should show TEST A",
+        "should not show this",
+    ]
 
 def test_read_file(capsys):
     assert capsys.readouterr().err == ""
@@ -324,3 +721,112 @@ def test_print_lines(capsys):
     print_lines(["a","b","c"])
     assert capsys.readouterr().err == "a\nb\nc\n"
 
+
+def test_stats(capsys):
+    stats_reset()
+    set_stats(True)
+    try:
+        eo("a", "b")
+        msg("data", [1, 2])
+        set_debug(0)
+        dbgmsg("not shown")
+        set_verbose(0)
+        verb("not shown")
+        vverb(2, "not shown")
+        verbmsg("not shown")
+        output_add(NullSink())
+        msg("discarded")
+        output_pop()
+        buf = output_buffer()
+        eo("capturé")
+        output_pop()
+        counts = stats()
+    finally:
+        set_stats(False)
+        stats_reset()
+    assert capsys.readouterr().err == "a b\ndata [1,2]\n"
+    assert buf.getvalue() == "capturé\n"
+    assert counts["eo"]["calls"] == 3
+    assert counts["eo"]["bytes"] == len("a b\ndata [1,2]\ncapturé\n".encode())
+    assert counts["msgx"]["calls"] == 1 and counts["msgx"]["suppressed"] == 1
+    assert counts["stringify"]["calls"] == 2
+    assert counts["dbgmsg"] == { "calls": 0, "suppressed": 1, "bytes": 0, "format_ns": 0, "write_ns": 0 }
+    assert (counts["verb"]["suppressed"], counts["vverb"]["suppressed"]) == (1, 2)
+    assert counts["output_pop"]["calls"] == 2 and counts["output_pop"]["bytes"] == len("capturé\n".encode())
+    assert counts["eo"]["format_ns"] > 0 and counts["eo"]["write_ns"] > 0
+    assert stats() == {}
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    yield now
+    set_rate_limit(None, summary_interval=10.0)
+
+def test_rate_limit(capsys, clock):
+    line = current_line_number() + 2
+    def retry(i):
+        warn("retry", i, rate="2/s")
+    for i in range(10):
+        retry(i)
+    assert capsys.readouterr().err == "WARNING: retry 0\nWARNING: retry 1\n"
+    clock[0] += 1.0
+    # a different call site has its own limit
+    eo("done", rate="2/s")
+    assert capsys.readouterr().err == "done\n"
+    for i in range(3):
+        retry(i)
+    assert capsys.readouterr().err == f"suppressed 8 messages from eyeo_test.py:{line}\nWARNING: retry 0\nWARNING: retry 1\n"
+
+def test_rate_limit_not_formatted(capsys, clock):
+    calls = []
+    def compute():
+        calls.append(1)
+        return "value"
+    for _ in range(5):
+        msg("computed", lazy(compute), rate="1/min", rate_key="compute")
+    assert capsys.readouterr().err == "computed value\n"
+    assert len(calls) == 1
+    clock[0] += 10.0
+    msg("computed", lazy(compute), rate="1/min", rate_key="compute")
+    assert capsys.readouterr().err == "suppressed 5 messages from compute\n"
+    rate_limit_flush()
+    assert capsys.readouterr().err == ""
+    assert len(calls) == 1
+
+@pytest.mark.usefixtures("clock")
+def test_set_rate_limit(capsys, monkeypatch):
+    set_rate_limit("3/s")
+    for i in range(5):
+        info("step", i)
+    for i in range(5):
+        eo("unlimited", i, rate=False)
+    rate_limit_flush()
+    out = capsys.readouterr().err.splitlines()
+    assert out[:3] == ["INFO: step 0", "INFO: step 1", "INFO: step 2"]
+    assert out[3:8] == [ f"unlimited {i}" for i in range(5) ]
+    assert out[8].startswith("suppressed 2 messages from eyeo_test.py:")
+    # the exit summary is registered once, however often the limiters are reset
+    registered = []
+    monkeypatch.setattr("atexit.register", registered.append)
+    for _ in range(3):
+        set_rate_limit("3/s")
+        info("again")
+    assert not registered
+    with pytest.raises(ValueError):
+        set_rate_limit("fast")
+    with pytest.raises(ValueError):
+        eo("x", rate="0/s")
+
+def test_output_dedup():
+    buf = output_buffer()
+    sink = output_dedup()
+    for _ in range(100):
+        info("polling", [1, 2])
+    warn("changed")
+    for _ in range(3):
+        eo("a", "b", indent="  ")
+    output_pop()
+    output_pop()
+    assert buf.getvalue() == "INFO: polling [1,2]\nlast message repeated 99 times\nWARNING: changed\n  a\n  b\nlast message repeated 2 times\n"
+    assert sink.collapsed == 101
@@ -0,0 +1,63 @@
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+"""
+Opt-in counters for the cost of eyeo's own output routines, see eyeo.set_stats() and eyeo.stats().
+
+When they are disabled, each instrumented routine only checks Instrument.enabled.
+The counters are not locked, so with many threads they are approximate.
+"""
+
+from time import perf_counter_ns
+
+class Counter:
+    """
+    The counts for one routine.
+    Nested calls are counted in each routine, eg the stringify() calls made by msg() are
+    counted for both msgx and stringify.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('calls', 'suppressed', 'bytes', 'format_ns', 'write_ns')
+
+    def __init__(self):
+        self.calls = 0          # the calls which produced output
+        self.suppressed = 0     # the calls which were discarded (eg debugging disabled)
+        self.bytes = 0          # the size of the output produced, encoded as utf-8
+        self.format_ns = 0      # the time spent formatting
+        self.write_ns = 0       # the time spent writing to the destination
+
+    def as_dict(self):
+        return { name: getattr(self, name) for name in self.__slots__ }
+
+class Instrument:
+    """ Scoping class for the instrumentation state """
+    # pylint: disable=too-few-public-methods
+    enabled = False
+    counters = {}
+
+def counter(name):
+    """
+    Return the Counter for a routine, creating it if needed.
+    """
+    found = Instrument.counters.get(name)
+    if found is None:
+        found = Instrument.counters.setdefault(name, Counter())
+    return found
+
+def encoded_size(text):
+    """
+    Return the size of some text in bytes, encoded as utf-8, without encoding ascii text.
+    """
+    return len(text) if text.isascii() else len(text.encode("utf-8", "surrogatepass"))
+
+def count_call(name, start, size=0):
+    """
+    Count a call which started (at perf_counter_ns() time start) and has just finished formatting
+    size bytes of output (see encoded_size()).
+    """
+    c = counter(name)
+    c.calls += 1
+    c.bytes += size
+    c.format_ns += perf_counter_ns() - start
+
+def count_suppressed(name):
+    counter(name).suppressed += 1
@@ -0,0 +1,132 @@
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+"""
+Collect the output of worker processes, and write it from the parent process.
+
+Worker processes which all write to an inherited stderr can interleave partial lines,
+and contend on the file descriptor. Instead, a worker can add a QueueSink to its output
+stack, which sends the already formatted text to a Collector thread in the parent,
+which writes it to the parent's output destination in batches.
+
+For example:
+
+    with Collector() as collector:
+        with ProcessPoolExecutor(initializer=worker_init, initargs=(collector.queue,)) as pool:
+            pool.map(work, items)
+"""
+
+import threading
+import multiprocessing
+import multiprocessing.util
+
+from queue import Empty
+
+from eyeo import output_add, output_current
+from eyeo.sinks import Sink, _register
+
+class QueueSink(Sink):
+    """
+    A sink for worker processes, which sends the written text to a Collector through a queue.
+    Each write from the output routines is a whole line, so lines are never split between records.
+
+    Parameters:
+        queue: the queue of the Collector
+        buffer_size (int): collect this many characters before sending them (0 sends each write)
+    """
+    def __init__(self, queue, buffer_size=0):
+        self.queue = queue
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
+        _register(self)
+        # multiprocessing children leave with os._exit(), which skips atexit
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=100)
+
+    def write(self, text):
+        if not self.buffer_size:
+            self.queue.put(text)
+            return len(text)
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.queue.put(data)
+
+    def after_fork(self):
+        self._buffer = []
+        self._size = 0
+
+def worker_init(queue, buffer_size=0):
+    """
+    Make the output routines of a worker process send their output to a Collector.
+    Suitable as the initializer of a multiprocessing.Pool or ProcessPoolExecutor.
+
+    Parameters:
+        queue: the queue of the Collector
+        buffer_size (int): see QueueSink
+    """
+    output_add(QueueSink(queue, buffer_size=buffer_size))
+
+class Collector:
+    """
+    Receives the output of worker processes (see QueueSink and worker_init()) in a thread of
+    the parent process, and writes it to a destination in batches.
+
+    Parameters:
+        fhandle (file): the destination, or None for the current output destination
+        queue: the queue to read records from, by default a new multiprocessing queue
+        batch (int): the maximum number of records to combine into one write
+    """
+    _STOP = None
+
+    def __init__(self, fhandle=None, queue=None, batch=256):
+        self.fhandle = fhandle if fhandle is not None else output_current()
+        self.queue = queue if queue is not None else multiprocessing.Queue()
+        self.batch = batch
+        self.records = 0
+        self._thread = threading.Thread(target=self._run, name="eyeo-collector", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        queue = self.queue
+        while True:
+            item = queue.get()
+            stop = item is self._STOP
+            records = [] if stop else [item]
+            while not stop and len(records) < self.batch:
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                else:
+                    records.append(item)
+            if records:
+                self.fhandle.write("".join(records))
+                self.fhandle.flush()
+                self.records += len(records)
+            if stop:
+                return
+
+    def close(self):
+        """
+        Write out everything received so far, and stop the collector thread.
+        The workers should have finished (and flushed their output) before this is called.
+        """
+        if self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
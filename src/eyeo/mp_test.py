@@ -0,0 +1,142 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+__pdoc__ = {
+    'pytest': False
+}
+
+import os
+import queue
+import select
+import signal
+import importlib
+import threading
+import multiprocessing
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+
+import eyeo
+from eyeo import msg, output_add, output_pop, stringify_value, set_stringify_cache
+from eyeo.sinks import BackgroundWriter, FileSink
+from eyeo.mp import *
+
+def _work(i):
+    for j in range(20):
+        msg("worker", i, "line", j, "x" * 200)
+    return i
+
+def test_collector_process_pool():
+    buf = StringIO()
+    with Collector(buf) as collector:
+        with ProcessPoolExecutor(max_workers=4, initializer=worker_init, initargs=(collector.queue, 1024)) as pool:
+            assert list(pool.map(_work, range(8))) == list(range(8))
+    lines = buf.getvalue().splitlines()
+    assert len(lines) == 8 * 20
+    expected = set(f"worker {i} line {j} " + "x" * 200 for i in range(8) for j in range(20))
+    assert set(lines) == expected
+
+def test_queue_sink():
+    q = queue.Queue()
+    sink = QueueSink(q)
+    output_add(sink)
+    msg("a")
+    msg("b")
+    output_pop()
+    assert [q.get_nowait(), q.get_nowait()] == ["a\n", "b\n"]
+
+    sink = QueueSink(q, buffer_size=100)
+    sink.write("a\n")
+    sink.write("b\n")
+    assert q.empty()
+    sink.flush()
+    assert q.get_nowait() == "a\nb\n"
+
+def test_collector():
+    buf = StringIO()
+    q = queue.Queue()
+    collector = Collector(buf, queue=q)
+    q.put("one\n")
+    q.put("two\n")
+    collector.close()
+    assert buf.getvalue() == "one\ntwo\n"
+    assert collector.records == 2
+
+def _fork_and_run(func):
+    """ run func in a forked child, and return b"ok" if it finished within a few seconds """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(rfd)
+            func()
+            os.write(wfd, b"ok")
+        finally:
+            os._exit(0)
+    os.close(wfd)
+    (ready, _, _) = select.select([rfd], [], [], 10)
+    if not ready:
+        os.kill(pid, signal.SIGKILL)
+    with os.fdopen(rfd, "rb") as reader:
+        status = reader.read() if ready else b"timed out"
+    os.waitpid(pid, 0)
+    return status
+
+def _fork_and_write(sink, text):
+    def write():
+        sink.write(text)
+        sink.flush()
+    return _fork_and_run(write)
+
+def test_fork_reinitializes_sinks():
+    # output buffered before the fork is written once (by the parent), and the child's
+    # copy of the background writer works even though its thread was not copied
+    path_buf = StringIO()
+    buffered = FileSink(path_buf, buffer_size=1024)
+    buffered.write("before fork\n")
+
+    fd_read, fd_write = os.pipe()
+    with os.fdopen(fd_write, "w") as handle:
+        writer = BackgroundWriter(handle)
+        writer.write("parent\n")
+        assert _fork_and_write(writer, "child\n") == b"ok"
+        writer.close()
+    with os.fdopen(fd_read) as reader:
+        assert sorted(reader.read().splitlines()) == ["child", "parent"]
+    assert path_buf.getvalue() == "before fork\n"
+
+def test_fork_resets_locks():
+    # the locks of the base output stack and of the stringify cache, held by another thread
+    # at the time of the fork, do not block the child
+    stringify_module = importlib.import_module("eyeo.stringify")
+    set_stringify_cache(10000)
+    locks = [ eyeo._output_base_lock, stringify_module._cache.lock ] # pylint: disable=protected-access
+    held = threading.Event()
+    release = threading.Event()
+    def hold():
+        for lock in locks:
+            lock.acquire() # pylint: disable=consider-using-with
+        held.set()
+        release.wait()
+        for lock in locks:
+            lock.release()
+    holder = threading.Thread(target=hold)
+    holder.start()
+    held.wait()
+    def child():
+        output_add(StringIO())
+        msg("in the child")
+        output_pop()
+        stringify_value((1, 2))
+    try:
+        assert _fork_and_run(child) == b"ok"
+    finally:
+        release.set()
+        holder.join()
+        set_stringify_cache(0)
+
+def test_worker_init():
+    q = multiprocessing.Queue()
+    worker_init(q)
+    msg("to the queue")
+    output_pop()
+    assert q.get(timeout=5) == "to the queue\n"
@@ -0,0 +1,418 @@
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+"""
+Output targets which can be placed on the eyeo output stack with output_add(),
+in place of a plain file handle.
+"""
+
+import os
+import abc
+import time
+import atexit
+import threading
+import weakref
+
+from io import StringIO
+from collections import deque
+
+OVERFLOW_POLICIES = ( "block", "drop", "drop-oldest" )
+
+class Registry:
+    """ Scoping class for the registry of live sinks which hold unwritten output """
+    # pylint: disable=too-few-public-methods
+    live = weakref.WeakSet()
+    atexit_registered = False
+
+def _register(sink):
+    Registry.live.add(sink)
+    if not Registry.atexit_registered:
+        Registry.atexit_registered = True
+        atexit.register(flush_all)
+
+def flush_all():
+    """
+    Flush all live buffering sinks and background writers.
+    Registered with atexit when the first one is created.
+    """
+    for sink in list(Registry.live):
+        sink.flush()
+
+def _before_fork():
+    # write out buffered output first, so that the child does not inherit (and repeat) it
+    for sink in list(Registry.live):
+        try:
+            # pylint: disable=bare-except
+            sink.flush()
+        except:
+            pass
+
+def _after_fork_in_child():
+    # the flusher thread does not exist in the child, and its lock may have been held
+    Flusher.cond = threading.Condition()
+    Flusher.deadlines = {}
+    Flusher.thread = None
+    for sink in list(Registry.live):
+        sink.after_fork()
+
+os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+class Flusher:
+    """
+    Scoping class for the thread which flushes sinks after a delay (eg FileSink's flush_interval).
+    A single daemon thread serves all the sinks, and is started when it is first needed.
+    """
+    # pylint: disable=too-few-public-methods
+    cond = threading.Condition()
+    # sink -> the time.monotonic() time to flush it
+    deadlines = {}
+    thread = None
+
+def _flush_later(sink, delay):
+    """
+    Flush a sink from the flusher thread in delay seconds, unless _flush_cancel() is called first.
+    """
+    with Flusher.cond:
+        if sink not in Flusher.deadlines:
+            Flusher.deadlines[sink] = time.monotonic() + delay
+            if Flusher.thread is None:
+                Flusher.thread = threading.Thread(target=_run_flusher, name="eyeo-flusher", daemon=True)
+                Flusher.thread.start()
+            Flusher.cond.notify()
+
+def _flush_cancel(sink):
+    with Flusher.cond:
+        Flusher.deadlines.pop(sink, None)
+
+def _run_flusher():
+    cond = Flusher.cond
+    with cond:
+        while True:
+            deadlines = Flusher.deadlines
+            if not deadlines:
+                cond.wait()
+                continue
+            now = time.monotonic()
+            due = [ sink for (sink, deadline) in deadlines.items() if deadline <= now ]
+            if not due:
+                cond.wait(min(deadlines.values()) - now)
+                continue
+            for sink in due:
+                del deadlines[sink]
+            # the sinks are flushed without the lock, as they take their own locks and call _flush_cancel()
+            cond.release()
+            try:
+                for sink in due:
+                    try:
+                        # pylint: disable=bare-except
+                        sink.flush()
+                    except:
+                        pass
+            finally:
+                cond.acquire()
+
+class Sink(abc.ABC):
+    """
+    Base class for output targets. A sink only needs write(text) and flush(); the output
+    routines look up the write method once, when the sink is added to the output stack.
+
+    Sinks with the 'discard' attribute set are known to throw their output away,
+    so the output routines can skip formatting altogether. Sinks with the 'records'
+    attribute set take structured records through emit(), see eyeo.structured.RecordSink.
+    """
+    discard = False
+    records = False
+
+    @abc.abstractmethod
+    def write(self, text):
+        """
+        Write some text.
+
+        Parameters:
+            text (str): the text
+
+        Returns:
+            int: the length of the text
+        """
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def isatty(self):
+        return False
+
+    def after_fork(self):
+        """
+        Called in a child process after a fork, to reset any locks, threads and buffers
+        that were copied from the parent.
+        """
+
+class FileSink(Sink):
+    """
+    A sink which collects the written text and writes it to a file handle in blocks.
+
+    The buffered text is written when:
+        - buffer_size characters have been buffered (0 writes every line immediately)
+        - flush_interval seconds have passed since the oldest buffered text, by the thread which
+          flushes all the sinks (see Flusher), so that the text is written even if nothing else is
+        - flush() is called, for example by eo(..., flush=True), output_pop() or at exit
+    """
+    def __init__(self, fhandle, buffer_size=8192, flush_interval=None):
+        self.fhandle = fhandle
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._size = 0
+        # whether the flusher thread is to flush the buffer, see _flush_later()
+        self._flush_pending = False
+        self._lock = threading.Lock()
+        _register(self)
+
+    def write(self, text):
+        with self._lock:
+            self._buffer.append(text)
+            self._size += len(text)
+            if self._size >= self.buffer_size:
+                self._write_buffer()
+            elif self.flush_interval is not None and not self._flush_pending:
+                self._flush_pending = True
+                _flush_later(self, self.flush_interval)
+        return len(text)
+
+    def _write_buffer(self):
+        # called with the lock held
+        if self._flush_pending:
+            self._flush_pending = False
+            _flush_cancel(self)
+        if self._buffer:
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.fhandle.write(data)
+
+    def flush(self):
+        with self._lock:
+            self._write_buffer()
+            self.fhandle.flush()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._flush_pending = False
+        self._buffer = []
+        self._size = 0
+
+    def isatty(self):
+        return self.fhandle.isatty()
+
+class StringSink(Sink):
+    """
+    A sink which captures the output in a string buffer. See getvalue().
+    """
+    def __init__(self):
+        # pylint: disable=method-hidden
+        self.buffer = StringIO()
+        self.write = self.buffer.write
+
+    def write(self, text):
+        # replaced by the bound StringIO.write in __init__
+        return self.buffer.write(text)
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+class NullSink(Sink):
+    """
+    A sink which discards everything. The output routines skip formatting when it is
+    the current output destination.
+    """
+    discard = True
+
+    def write(self, text):
+        return len(text)
+
+class DedupSink(Sink):
+    """
+    A sink which collapses repeated output. A write which is the same as the previous one is
+    counted instead of written, and the count is written as a single line (see 'message') when:
+        - a different text is written
+        - timeout seconds have passed since the first uncounted repeat, by the thread which
+          flushes all the sinks (see Flusher), so that the count is written even if nothing else is
+        - flush() is called, for example by output_pop() or at exit
+
+    Each write of the output routines is one call, so a repeated multi-line message is
+    collapsed as a whole. A single repeat is written as it was, rather than counted.
+    The number of repeats which were not written is kept in the 'collapsed' attribute.
+    """
+    def __init__(self, fhandle, timeout=None, message="last message repeated {count} times\n"):
+        self.fhandle = fhandle
+        self.timeout = timeout
+        self.message = message
+        self.collapsed = 0
+        self._last = None
+        self._count = 0
+        # whether the flusher thread is to write the count, see _flush_later()
+        self._flush_pending = False
+        self._lock = threading.Lock()
+        _register(self)
+
+    def write(self, text):
+        with self._lock:
+            if text == self._last:
+                self._count += 1
+                if self.timeout is not None and not self._flush_pending:
+                    self._flush_pending = True
+                    _flush_later(self, self.timeout)
+                return len(text)
+            if self._count:
+                self._report()
+            self._last = text
+            self.fhandle.write(text)
+        return len(text)
+
+    def _report(self):
+        # called with the lock held
+        if self._flush_pending:
+            self._flush_pending = False
+            _flush_cancel(self)
+        if self._count == 1:
+            self.fhandle.write(self._last)
+        else:
+            self.fhandle.write(self.message.format(count=self._count))
+            self.collapsed += self._count
+        self._count = 0
+
+    def flush(self):
+        with self._lock:
+            if self._count:
+                self._report()
+            self.fhandle.flush()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._flush_pending = False
+        self._count = 0
+
+    def isatty(self):
+        return self.fhandle.isatty()
+
+class BackgroundWriter(Sink):
+    """
+    A sink which queues the written text and writes it to the real
+    file handle from a background thread, in batches (using writelines), so that the
+    threads which produce output do not stall on slow pipes or filesystems.
+
+    The queue is bounded. When it is full, the overflow policy decides what happens:
+        block:       wait until the writer thread has made room
+        drop:        discard the new text
+        drop-oldest: discard the oldest queued text to make room
+
+    Discarded writes are counted in the 'dropped' attribute.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, fhandle, maxsize=1024, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {OVERFLOW_POLICIES}")
+        self.fhandle = fhandle
+        self.maxsize = max(1, maxsize)
+        self.overflow = overflow
+        self.dropped = 0
+        self.errors = 0
+        self.closed = False
+        self._start()
+        _register(self)
+
+    def _start(self):
+        self._cond = threading.Condition()
+        self._pending = deque()
+        # sequence numbers of queued and completed writes, used by flush()
+        self._queued = 0
+        self._done = 0
+        self._thread = threading.Thread(target=self._run, name="eyeo-writer", daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        # the writer thread does not exist in the child, and the lock may have been held
+        # by it at the time of the fork, so start over (the parent writes what was queued)
+        if not self.closed:
+            self._start()
+
+    def write(self, text):
+        """
+        Queue some text to be written by the background thread.
+
+        Parameters:
+            text (str): the text
+
+        Returns:
+            int: the length of the text
+        """
+        with self._cond:
+            if self.closed:
+                return self.fhandle.write(text)
+            pending = self._pending
+            while len(pending) >= self.maxsize:
+                if self.overflow == "drop":
+                    self.dropped += 1
+                    return len(text)
+                if self.overflow == "drop-oldest":
+                    pending.popleft()
+                    self.dropped += 1
+                    self._done += 1
+                    break
+                self._cond.wait()
+            pending.append(text)
+            self._queued += 1
+            self._cond.notify_all()
+        return len(text)
+
+    def _run(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while not self._pending and not self.closed:
+                    cond.wait()
+                if not self._pending:
+                    return
+                batch = list(self._pending)
+                self._pending.clear()
+                # wake any producers blocked on a full queue
+                cond.notify_all()
+            try:
+                # pylint: disable=bare-except
+                self.fhandle.writelines(batch)
+                if not self._pending:
+                    self.fhandle.flush()
+            except:
+                self.errors += 1
+            with cond:
+                self._done += len(batch)
+                cond.notify_all()
+
+    def flush(self):
+        """
+        Wait until everything written so far has been written to the real file handle, and flush it.
+        """
+        with self._cond:
+            target = self._queued
+            while self._done < target and self._thread.is_alive():
+                self._cond.wait()
+        self.fhandle.flush()
+
+    def close(self):
+        """
+        Flush the queued text and stop the background thread. The real file handle is not closed.
+        Any later writes go directly to the real file handle.
+        """
+        if self.closed:
+            return
+        self.flush()
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        Registry.live.discard(self)
+
+    def isatty(self):
+        return self.fhandle.isatty()
@@ -0,0 +1,185 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+__pdoc__ = {
+    'pytest': False
+}
+
+import time
+import threading
+from io import StringIO
+
+import pytest
+
+from eyeo.sinks import *
+
+class BlockedHandle(StringIO):
+    """ a string buffer whose writes wait until it is released, to simulate a slow destination """
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.entered = threading.Event()
+    def writelines(self, lines):
+        self.entered.set()
+        self.release.wait()
+        super().writelines(lines)
+
+class CountingHandle(StringIO):
+    """ a string buffer which counts the writes it receives """
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+def wait_for(condition, timeout=5.0):
+    """ wait until condition() is true, and return whether it is """
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.005)
+    return condition()
+
+def test_file_sink_buffer_size():
+    handle = CountingHandle()
+    sink = FileSink(handle, buffer_size=10)
+    sink.write("1234\n")
+    assert handle.writes == 0
+    sink.write("5678\n")
+    assert handle.writes == 1
+    assert handle.getvalue() == "1234\n5678\n"
+    sink.write("abc\n")
+    sink.flush()
+    assert handle.writes == 2
+    assert handle.getvalue() == "1234\n5678\nabc\n"
+
+def test_file_sink_write_through():
+    handle = CountingHandle()
+    sink = FileSink(handle, buffer_size=0)
+    sink.write("a\n")
+    sink.write("b\n")
+    assert handle.writes == 2
+
+def test_file_sink_flush_interval():
+    handle = CountingHandle()
+    sink = FileSink(handle, flush_interval=0.2)
+    sink.write("a\n")
+    sink.write("b\n")
+    assert handle.writes == 0
+    # written by the timer, without another write
+    assert wait_for(lambda: handle.writes)
+    assert handle.getvalue() == "a\nb\n"
+    sink.write("c\n")
+    sink.flush()
+    time.sleep(0.3)
+    assert (handle.writes, handle.getvalue()) == (2, "a\nb\nc\n")
+
+def test_file_sink_flush_interval_thread():
+    # one thread flushes all the sinks, however many flush windows there are
+    handles = [ CountingHandle() for _ in range(3) ]
+    sinks = [ FileSink(h, flush_interval=0.05) for h in handles ]
+    for i in range(3):
+        for sink in sinks:
+            sink.write(f"{i}\n")
+        assert wait_for(lambda count=i + 1: all(h.writes == count for h in handles))
+    assert [ h.getvalue() for h in handles ] == [ "0\n1\n2\n" ] * 3
+    assert [ t.name for t in threading.enumerate() ].count("eyeo-flusher") == 1
+
+def test_string_sink():
+    sink = StringSink()
+    sink.write("a\n")
+    sink.write("b\n")
+    assert sink.getvalue() == "a\nb\n"
+
+def test_sink_write_required():
+    # pylint: disable=abstract-method,abstract-class-instantiated
+    class NoWrite(Sink):
+        pass
+    with pytest.raises(TypeError):
+        NoWrite()
+
+def test_null_sink():
+    sink = NullSink()
+    assert sink.discard
+    assert sink.write("abc") == 3
+    sink.flush()
+
+def test_dedup_sink():
+    handle = StringIO()
+    sink = DedupSink(handle)
+    for _ in range(1000):
+        sink.write("same\n")
+    sink.write("other\n")
+    sink.write("other\n")
+    sink.write("last\n")
+    sink.write("last\n")
+    sink.write("last\n")
+    assert handle.getvalue() == "same\nlast message repeated 999 times\nother\nother\nlast\n"
+    sink.flush()
+    sink.flush()
+    assert handle.getvalue().endswith("last\nlast message repeated 2 times\n")
+    assert sink.collapsed == 1001
+
+def test_dedup_sink_timeout():
+    handle = StringIO()
+    sink = DedupSink(handle, timeout=0.2, message="repeated {count}x\n")
+    for _ in range(5):
+        sink.write("a\n")
+    assert handle.getvalue() == "a\n"
+    # written by the timer, without another write
+    assert wait_for(lambda: handle.getvalue() == "a\nrepeated 4x\n")
+    sink.write("a\n")
+    sink.write("b\n")
+    time.sleep(0.3)
+    assert handle.getvalue() == "a\nrepeated 4x\na\nb\n"
+    # the count is written by the same thread as the FileSink intervals
+    assert [ t.name for t in threading.enumerate() ].count("eyeo-flusher") == 1
+
+def test_background_writer():
+    buf = StringIO()
+    writer = BackgroundWriter(buf)
+    for i in range(100):
+        writer.write(f"{i}\n")
+    writer.flush()
+    assert buf.getvalue() == "".join(f"{i}\n" for i in range(100))
+    writer.close()
+    writer.write("after close\n")
+    assert buf.getvalue().endswith("99\nafter close\n")
+
+def test_background_writer_overflow_policy():
+    with pytest.raises(ValueError):
+        BackgroundWriter(StringIO(), overflow="explode")
+
+def _fill(writer, handle):
+    writer.write("first\n")
+    # wait for the writer thread to take the first write, then fill the queue behind it
+    handle.entered.wait()
+    for i in range(5):
+        writer.write(f"{i}\n")
+
+def test_background_writer_drop():
+    handle = BlockedHandle()
+    writer = BackgroundWriter(handle, maxsize=2, overflow="drop")
+    _fill(writer, handle)
+    assert writer.dropped == 3
+    handle.release.set()
+    writer.close()
+    assert handle.getvalue() == "first\n0\n1\n"
+
+def test_background_writer_drop_oldest():
+    handle = BlockedHandle()
+    writer = BackgroundWriter(handle, maxsize=2, overflow="drop-oldest")
+    _fill(writer, handle)
+    assert writer.dropped == 3
+    handle.release.set()
+    writer.close()
+    assert handle.getvalue() == "first\n3\n4\n"
+
+def test_flush_all():
+    handle = BlockedHandle()
+    writer = BackgroundWriter(handle)
+    writer.write("queued\n")
+    handle.release.set()
+    flush_all()
+    assert handle.getvalue() == "queued\n"
+    writer.close()
@@ -5,6 +5,16 @@ compact string dumper for objects intended to 'kind of' show the object, ie show
 however prevent gigantic dumps of text through depth limits and string ellipsis
 """
 
+import os
+import sys
+import heapq
+import threading
+
+from itertools import islice
+from collections import OrderedDict
+
+from eyeo.instrument import Instrument, count_call, encoded_size, perf_counter_ns
+
 def is_obj(x):
     """
     A quick (but maybe not perfect) check for object types
@@ -19,7 +29,7 @@ def is_obj(x):
     except:
         return False
 
-def stringify_value(v, maxDepth=None, maxItems=-1, maxStrlen=-1):
+def stringify_value(v, maxDepth=None, maxItems=-1, maxStrlen=-1, sortKeys=True):
     """
     Use stringify() to convert a value to a string, and return the string representation.
 
@@ -28,10 +38,10 @@ def stringify_value(v, maxDepth=None, maxItems=-1, maxStrlen=-1):
     Returns:
         the string representation of the object
     """
-    (_, result) = stringify(v, maxDepth, maxItems, maxStrlen)
+    (_, result) = stringify(v, maxDepth, maxItems, maxStrlen, sortKeys)
     return result
 
-def stringify(v, maxDepth=None, maxItems=-1, maxStrlen=-1):
+def stringify(v, maxDepth=None, maxItems=-1, maxStrlen=-1, sortKeys=True):
     """
     Convert a dict to a string representation.
 
@@ -40,13 +50,19 @@ def stringify(v, maxDepth=None, maxItems=-1, maxStrlen=-1):
         maxDepth (int|None):   if > 0, then ellipsise structures deeper than this
         maxItems (int|-1):     if > 0, then ellipsise lists longer than this or dicts with more than this many items
         maxStrlen (int|-1):    if > 0, then ellipsise strings longer than this
+        sortKeys (bool):       show dict items in key order (or else in insertion order)
 
     Returns:
         tuple(depth:int, str): the depth (explored) of the structure and the string representation of the data
     """
-    return _stringify(v, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen)
-
-def _stringify(v, maxDepth=None, maxItems=-1, maxStrlen=-1, callingDepth=0, recursionMap=None):
+    if Instrument.enabled:
+        start = perf_counter_ns()
+        result = _stringify(v, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen, sortKeys=sortKeys)
+        count_call("stringify", start, encoded_size(result[1]))
+        return result
+    return _stringify(v, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen, sortKeys=sortKeys)
+
+def _stringify(v, maxDepth=None, maxItems=-1, maxStrlen=-1, callingDepth=0, recursionMap=None, sortKeys=True):
     """
     Private implementation of stringify()
 
@@ -58,41 +74,157 @@ def _stringify(v, maxDepth=None, maxItems=-1, maxStrlen=-1, callingDepth=0, recu
     Returns:
         tuple(depth:int, str): the depth (explored) of the structure and the string representation of the data
     """
-    # pylint: disable=too-many-return-statements,too-many-arguments
-    if v is None:
-        return ( 1, "(None)" )
-    if recursionMap is None:
-        recursionMap = {}
-
-    t = type(v)
-    r = t.__name__
-
-    if len(r) > 0:
-        if t not in [ int, float, str, bool, type(None) ]:
-            if id(v) in recursionMap:
-                return (1, "(recursion)")
-            recursionMap[id(v)] = 1
-
-    if t in [list, tuple]:
-        return _stringify_array(v, maxDepth, maxItems, maxStrlen, callingDepth, recursionMap)
-    if t in [dict] or 'AttrDict' in str(t):
-        return _stringify_hash(v, maxDepth, maxItems, maxStrlen, callingDepth, recursionMap)
-    if 'Gtk' in r or 'Gdk' in r or 'Glib' in r:
-        return (1,"(Gtk-object)")
-    if isinstance(v, str):
-        return (1, v)
-    if is_obj(v):
-        d = dict(v.__dict__)
-        (depth, result) = _stringify(d, maxDepth, maxItems, maxStrlen, callingDepth, recursionMap)
-        return (depth, r + result)
-    if callable(v):
-        return (1,"(callable)")
-    return (1, str(v))
+    # pylint: disable=too-many-arguments,unused-argument
+    cache = _cache
+    if cache is not None and recursionMap is None and type(v) in _CACHEABLE:
+        key = (id(v), maxDepth, maxItems, maxStrlen, sortKeys)
+        result = cache.get(key)
+        if result is not None:
+            return result
+    parts = []
+    engine = _Engine(maxItems, maxStrlen, recursionMap, parts.append, sortKeys)
+    depth = engine.run(engine.open(v, maxDepth))
+    result = (depth, "".join(parts))
+    if cache is not None and recursionMap is None and type(v) in _CACHEABLE and engine.pure:
+        cache.put(key, v, result)
+    return result
+
+def stringify_to(stream, v, maxDepth=None, maxItems=-1, maxStrlen=-1, sortKeys=True):
+    """
+    Like stringify(), but write the string representation to a stream (eg a StringIO, or an
+    output handle) in fragments as it is produced, rather than building and returning it.
+
+    Parameters:
+        stream (file): anything with a write(str) method
+        (others): see stringify()
+
+    Returns:
+        int: the depth (explored) of the structure
+    """
+    if Instrument.enabled:
+        start = perf_counter_ns()
+        (depth, result) = _stringify(v, maxDepth, maxItems, maxStrlen, sortKeys=sortKeys)
+        count_call("stringify", start, encoded_size(result))
+        stream.write(result)
+        return depth
+    if _cache is not None and type(v) in _CACHEABLE:
+        (depth, result) = _stringify(v, maxDepth, maxItems, maxStrlen, sortKeys=sortKeys)
+        stream.write(result)
+        return depth
+    engine = _Engine(maxItems, maxStrlen, None, stream.write, sortKeys)
+    return engine.run(engine.open(v, maxDepth))
+
+class _Cache:
+    """
+    A cache of the stringify() results for immutable values, see set_stringify_cache().
+
+    The entries are keyed by the id of the value and the limits, and keep a reference to the
+    value so that its id cannot be reused while the entry exists. The size of an entry is that
+    of its text plus that of the value (not including the items within it), as the value is
+    kept alive by the cache.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, v, result):
+        size = sys.getsizeof(result[1]) + sys.getsizeof(v)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self.entries[key] = (v, result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                (_, (_, _, evicted)) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+# the cache for stringify(), or None if it is disabled
+_cache = None
+
+def _after_fork_in_child():
+    # another thread of the parent may have held the lock of the cache at the time of the fork
+    cache = _cache
+    if cache is not None:
+        cache.lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def set_stringify_cache(max_bytes):
+    """
+    Enable (or disable) caching of the results of stringify() and stringify_to() for immutable
+    values, ie tuples and frozensets (or types marked with mark_cacheable()) which contain only
+    immutable values. Only the value passed to stringify() is cached, not the values within it,
+    and the cache is keyed by its identity, so it helps when the same value is output repeatedly.
+    The least recently used results are discarded to stay within max_bytes, which counts the
+    cached text and the values the cache keeps alive (but not the items within them).
+
+    Parameters:
+        max_bytes (int): the memory to use for the cache, or 0 to disable it
+    """
+    global _cache # pylint: disable=global-statement
+    _cache = _Cache(max_bytes) if max_bytes > 0 else None
+
+def stringify_cache_stats():
+    """
+    Return the statistics of the stringify() cache.
+
+    Returns:
+        dict: hits, misses, evictions, entries, bytes and max_bytes, or None if the cache is disabled
+    """
+    cache = _cache
+    return None if cache is None else cache.stats()
+
+def mark_cacheable(t):
+    """
+    Declare that the values of a type are immutable, so that set_stringify_cache() can cache
+    their stringify() results, and the results of tuples containing them.
+
+    Parameters:
+        t (type): the type
+    """
+    _IMMUTABLE.add(t)
+    _CACHEABLE.add(t)
 
 def stringify_array(v,
                     maxDepth=None,
                     maxItems=-1,
-                    maxStrlen=-1):
+                    maxStrlen=-1,
+                    sortKeys=True):
     """
     Convert a dict to a string representation.
 
@@ -101,19 +233,21 @@ def stringify_array(v,
         maxDepth (int|None):   if > 0, then ellipsise structures deeper than this
         maxItems (int|-1):     if > 0, then ellipsise lists longer than this or dicts with more than this many items
         maxStrlen (int|-1):    if > 0, then ellipsise strings longer than this
+        sortKeys (bool):       show dict items in key order (or else in insertion order)
 
     Returns:
         tuple(depth:int, str): the depth (explored) of the structure and the string representation of the data
     """
-    return _stringify_array(v, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen)
+    return _stringify_array(v, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen, sortKeys=sortKeys)
 
 def _stringify_array(v,
                     maxDepth=None,
                     maxItems=-1,
                     maxStrlen=-1,
                     callingDepth=0,
-                    recursionMap=None):
-    # pylint: disable=too-many-arguments
+                    recursionMap=None,
+                    sortKeys=True):
+    # pylint: disable=too-many-arguments,unused-argument
     """
     Private implementation of stringify_array()
 
@@ -125,53 +259,14 @@ def _stringify_array(v,
     Returns:
         tuple(depth:int, str): the depth (explored) of the structure and the string representation of the data
     """
-    if not v:
-        return (0, "[]" )
-
-    if recursionMap is None:
-        recursionMap = {}
-
-    count = len(v)
-
-    result = None
-
-    if maxDepth == 0:
-        result = f"[({count} items)]"
+    parts = []
+    engine = _Engine(maxItems, maxStrlen, recursionMap, parts.append, sortKeys)
+    depth = engine.run(engine.open_array(v, maxDepth))
+    return (depth, "".join(parts))
 
-        if maxItems >= 0:
-            return (0, result)
 
-    if maxDepth is not None:
-        maxDepth -= 1
 
-    max_inner_depth = 0
-    out = []
-
-    for item in v:
-        (depth, child) = _stringify(item, maxDepth, maxItems, maxStrlen, callingDepth + 1, recursionMap)
-
-        if depth > max_inner_depth:
-            max_inner_depth = depth
-
-        out.append(child)
-
-    if maxItems >= 0:
-        more = len(out) - maxItems
-        if maxItems >= 0 and more > 0:
-            out = out[0:maxItems] + [f"...(+{more} items)"]
-
-    if result is None:
-        result = ",".join(out)
-
-    if 3 <= maxStrlen < len(result):
-        result = result[0:maxStrlen-3] + "..."
-
-    result = "[" + result + "]"
-    return (max_inner_depth + 1, result)
-
-
-
-def stringify_hash(d, maxDepth=None, maxItems=-1, maxStrlen=-1):
+def stringify_hash(d, maxDepth=None, maxItems=-1, maxStrlen=-1, sortKeys=True):
     """
     Convert a dict to a string representation.
 
@@ -180,11 +275,12 @@ def stringify_hash(d, maxDepth=None, maxItems=-1, maxStrlen=-1):
         maxDepth (int|None):   if > 0, then ellipsise structures deeper than this
         maxItems (int|-1):     if > 0, then ellipsise lists longer than this or dicts with more than this many items
         maxStrlen (int|-1):    if > 0, then ellipsise strings longer than this
+        sortKeys (bool):       show dict items in key order (or else in insertion order)
 
     Returns:
         tuple(depth:int, str): the depth (explored) of the structure and the string representation of the data
     """
-    return _stringify_hash(d, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen)
+    return _stringify_hash(d, maxDepth=maxDepth, maxItems=maxItems, maxStrlen=maxStrlen, sortKeys=sortKeys)
 
 
 def _stringify_hash(
@@ -193,8 +289,9 @@ def _stringify_hash(
         maxItems=-1,
         maxStrlen=-1,
         callingDepth=0,
-        recursionMap=None):
-    # pylint: disable=too-many-arguments,too-many-locals
+        recursionMap=None,
+        sortKeys=True):
+    # pylint: disable=too-many-arguments,unused-argument
     """
     Private implementation for stringify_hash(), with extra parameters for internal use only.
 
@@ -206,45 +303,529 @@ def _stringify_hash(
     Returns:
         tuple(depth:int, str): the depth (explored) of the structure and the string representation of the data
     """
-    if not d:
-        return (0, "{}")
+    parts = []
+    engine = _Engine(maxItems, maxStrlen, recursionMap, parts.append, sortKeys)
+    depth = engine.run(engine.open_hash(d, maxDepth))
+    return (depth, "".join(parts))
+
+class _Frame:
+    """
+    A list or dict which is part way through being written by the _Engine.
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    __slots__ = ('items', 'rest', 'mapping', 'key', 'maxDepth', 'sep', 'more', 'limit', 'buffer', 'parent', 'depth')
+
+    def __init__(self, items, rest, mapping, maxDepth, more, limit=-1, buffer=None, parent=None):
+        # pylint: disable=too-many-arguments
+        self.items = items        # iterator over the list items or dict keys which will be shown
+        self.rest = rest          # dict keys which are not shown but still count towards the depth, or None
+        self.mapping = mapping    # the dict (None for a list)
+        self.key = None           # the dict key of the item being written
+        self.maxDepth = maxDepth  # the maxDepth for the items
+        self.sep = ""             # written before the next item
+        self.more = more          # the number of items which are not shown
+        self.limit = limit        # stop once the buffered items are longer than this (maxStrlen), or -1
+        self.buffer = buffer      # the _Buffer collecting the items, if they are cut to maxStrlen at the end
+        self.parent = parent      # the write function to restore when a buffered frame is closed
+        self.depth = 0
+
+class _Buffer:
+    """
+    Collects the text of a list which may be cut to maxStrlen once it is complete.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('parts', 'length')
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+
+_END = object()
+
+def _fallback_order(key):
+    """
+    The sort key for dict keys which cannot be compared with each other (eg a mix of int and str)
+    """
+    return (type(key).__name__, repr(key))
 
-    if recursionMap is None:
-        recursionMap = {}
+# types which are converted with str() and never checked for recursion
+_UNTRACKED = frozenset((int, float, str, bool, type(None)))
 
-    keys = d.keys()
-    nkeys = len(keys)
-    ordered = sorted(keys)
-    result = None
+# types whose stringify() result cannot change, if they only contain values of these types
+_IMMUTABLE = set(_UNTRACKED) | { tuple, frozenset, bytes, complex, range }
 
-    if maxDepth == 0:
-        result = "{(" + str(nkeys) + " items)}"
+# types which can be cached by set_stringify_cache(), when they are passed to stringify()
+_CACHEABLE = { tuple, frozenset }
 
-        if maxItems >= 0:
-            return (0, result)
+class _Engine:
+    """
+    Writes the string representation of a value as a sequence of fragments, walking nested
+    lists, dicts and objects with an explicit stack of _Frame rather than by recursion, so
+    that the cost per item is low and deeply nested data cannot raise RecursionError.
 
-    if maxDepth is not None:
-        maxDepth -= 1
+    The fragments go straight to the write function, so the text of a nested structure is
+    not copied at every level. Only a list which may be cut to maxStrlen is collected first,
+    and it stops collecting once it is longer than maxStrlen.
 
-    out = []
-    max_inner_depth = 0
+    Only the items which can appear in the result are converted: lists and dicts stop after
+    maxItems items. The counts of omitted items come from len(), and the depth covers the
+    items which were visited.
+    """
+    def __init__(self, maxItems, maxStrlen, recursionMap, write, sortKeys=True):
+        # pylint: disable=too-many-arguments
+        self.maxItems = maxItems
+        self.maxStrlen = maxStrlen
+        self.sortKeys = sortKeys
+        self.recursionMap = {} if recursionMap is None else recursionMap
+        self.write = write
+        self.stack = []
+        self.pure = True          # False once a mutable value has been visited
+
+    def open(self, v, maxDepth):
+        """
+        Start writing a value.
+
+        Returns:
+            int | None: the depth of the value if it has been written, or None if a frame was pushed to write it
+        """
+        t = type(v)
+
+        if t not in _UNTRACKED:
+            if id(v) in self.recursionMap:
+                self.write("(recursion)")
+                return 1
+            self.recursionMap[id(v)] = 1
+            if t not in _IMMUTABLE:
+                self.pure = False
+
+        handler = _handlers.get(t)
+        if handler is None:
+            handler = _resolve_handler(t)
+        return handler(self, v, maxDepth)
+
+    def open_array(self, v, maxDepth):
+        if not v:
+            self.write("[]")
+            return 0
+
+        count = len(v)
+        maxItems = self.maxItems
+        maxStrlen = self.maxStrlen
+
+        if maxDepth == 0:
+            result = f"[({count} items)]"
+
+            if maxItems >= 0:
+                self.write(result)
+                return 0
+
+            if 3 <= maxStrlen < len(result):
+                result = result[0:maxStrlen-3] + "..."
+            self.write("[" + result + "]")
+
+            # the items are not shown, but still count towards the depth
+            return self.measure_items(v) + 1
+
+        if maxDepth is not None:
+            maxDepth -= 1
+
+        more = 0
+        items = iter(v)
+        if 0 <= maxItems < count:
+            more = count - maxItems
+            items = islice(items, maxItems)
+
+        if maxStrlen >= 3:
+            buffer = _Buffer()
+            self.stack.append(_Frame(items, None, None, maxDepth, more, maxStrlen, buffer, self.write))
+            self.write = buffer.write
+        else:
+            self.write("[")
+            self.stack.append(_Frame(items, None, None, maxDepth, more))
+        return None
+
+    def open_hash(self, d, maxDepth, prefix=""):
+        if not d:
+            self.write(prefix + "{}")
+            return 0
+
+        keys = d.keys()
+        nkeys = len(keys)
+        maxItems = self.maxItems
+
+        if maxDepth == 0:
+            self.write(prefix + "{(" + str(nkeys) + " items)}")
+
+            if maxItems >= 0:
+                return 0
+
+            # the items are not shown, but still count towards the depth
+            return self.measure_items([ d[k] for k in self.ordered_keys(keys) ]) + 1
+
+        if maxDepth is not None:
+            maxDepth -= 1
+
+        more = 0
+        rest = None
+        if 0 <= maxItems < nkeys:
+            more = nkeys - maxItems
+            shown = self.first_keys(keys, maxItems)
+        elif maxItems < 0:
+            # a negative maxItems leaves that many items off the end, which still count towards the depth
+            more = nkeys - maxItems
+            ordered = self.ordered_keys(keys)
+            cut = max(0, nkeys + maxItems)
+            shown = ordered[0:cut]
+            rest = ordered[cut:]
+        else:
+            shown = self.ordered_keys(keys)
+
+        self.write(prefix + "{")
+        self.stack.append(_Frame(iter(shown), rest, d, maxDepth, more))
+        return None
+
+    def ordered_keys(self, keys):
+        """
+        Return all the keys of a dict, in the order they are shown.
+        """
+        if not self.sortKeys:
+            return list(keys)
+        try:
+            return sorted(keys)
+        except TypeError:
+            return sorted(keys, key=_fallback_order)
+
+    def first_keys(self, keys, n):
+        """
+        Return the first n keys of a dict in the order they are shown, without sorting all of them.
+        """
+        if not self.sortKeys:
+            return list(islice(keys, n))
+        try:
+            return heapq.nsmallest(n, keys)
+        except TypeError:
+            return heapq.nsmallest(n, keys, key=_fallback_order)
+
+    def close(self, frame):
+        """
+        Finish writing a frame (which has been popped from the stack).
+
+        Returns:
+            int: the depth of the list or dict
+        """
+        depth = frame.depth
+        more = f"{frame.sep}...(+{frame.more} items)" if frame.more > 0 else ""
+
+        if frame.mapping is not None:
+            if frame.rest is not None:
+                depth = max(depth, self.measure_items([ frame.mapping[k] for k in frame.rest ]))
+            self.write(more + "}")
+        elif frame.buffer is not None:
+            result = "".join(frame.buffer.parts) + more
+            if len(result) > self.maxStrlen:
+                result = result[0:self.maxStrlen-3] + "..."
+            self.write = frame.parent
+            self.write("[" + result + "]")
+        else:
+            self.write(more + "]")
+
+        return depth + 1
+
+    def run(self, res):
+        """
+        Write the items of any frames pushed by open(), until the original value is complete.
+
+        Parameters:
+            res: the return value of open()
+
+        Returns:
+            int: the depth (explored) of the structure
+        """
+        # pylint: disable=too-many-branches
+        stack = self.stack
+        open_value = self.open
+        while stack:
+            frame = stack[-1]
+            mapping = frame.mapping
+            items = frame.items
+            buffer = frame.buffer
+            depth = frame.depth
+            sep = frame.sep
+            write = self.write
+            while True:
+                if res is not None:
+                    # the depth of an item which was written by open(), or by a frame just closed
+                    if res > depth:
+                        depth = res
+                    res = None
+                    sep = ","
+                    if buffer is not None and buffer.length > frame.limit:
+                        # the rest of the list would be cut off by maxStrlen
+                        items = frame.items = iter(())
+
+                item = next(items, _END)
+                if item is _END:
+                    frame.depth = depth
+                    frame.sep = sep
+                    stack.pop()
+                    res = self.close(frame)
+                    break
+                if mapping is not None:
+                    frame.key = item
+                    item = mapping[frame.key]
+                    prefix = f"{sep}{frame.key}="
+                else:
+                    prefix = sep
+
+                # plain values are written inline
+                t = type(item)
+                if t in _UNTRACKED:
+                    if t is not str:
+                        item = "(None)" if item is None else str(item)
+                    write(prefix + item)
+                    res = 1
+                    continue
+
+                if prefix:
+                    write(prefix)
+                res = open_value(item, frame.maxDepth)
+                if res is None:
+                    # the item pushed a frame of its own, continue with that
+                    frame.depth = depth
+                    frame.sep = ","
+                    break
+        return res
+
+    def measure_items(self, items):
+        """
+        Return the greatest depth of some values which are not shown, or 0 if there are none.
+        """
+        depth = 0
+        for item in items:
+            item_depth = self.measure(item)
+            if item_depth > depth:
+                depth = item_depth
+        return depth
+
+    def measure(self, v):
+        """
+        Return the depth that would be reported for a value which is not shown
+        (beyond maxDepth, or left off by a negative maxItems), without converting it.
+        The objects visited are still recorded for recursion detection.
+
+        Returns:
+            int: the depth
+        """
+        stack = []
+        depth = self._measure_open(v, stack)
+        while stack:
+            entry = stack[-1]
+            if depth is not None:
+                if depth > entry[1]:
+                    entry[1] = depth
+                depth = None
+            item = next(entry[0], _END)
+            if item is _END:
+                stack.pop()
+                depth = entry[1] + 1
+            else:
+                depth = self._measure_open(item, stack)
+        return depth
+
+    def _measure_open(self, v, stack):
+        t = type(v)
+        if t in _UNTRACKED:
+            return 1
+        if id(v) in self.recursionMap:
+            return 1
+        self.recursionMap[id(v)] = 1
+        if t not in _IMMUTABLE:
+            self.pure = False
+
+        handler = _handlers.get(t)
+        if handler is None:
+            handler = _resolve_handler(t)
+        if handler is _Engine.open_array:
+            children = v
+        elif handler is _Engine.open_hash:
+            children = v.values()
+        elif handler is _open_obj and hasattr(v, '__dict__'):
+            children = dict(v.__dict__).values()
+        else:
+            return 1
+
+        if not children:
+            return 0
+        stack.append([iter(children), 0])
+        return None
+
+# the handlers which write a value for the _Engine, called as handler(engine, value, maxDepth)
+# and returning the depth of the value, or None if they pushed a frame to write it
+
+def _write_none(engine, v, maxDepth):
+    # pylint: disable=unused-argument
+    engine.write("(None)")
+    return 1
+
+def _write_text(engine, v, maxDepth):
+    # pylint: disable=unused-argument
+    engine.write(v)
+    return 1
+
+def _write_str(engine, v, maxDepth):
+    # pylint: disable=unused-argument
+    engine.write(str(v))
+    return 1
+
+def _write_gtk(engine, v, maxDepth):
+    # pylint: disable=unused-argument
+    engine.write("(Gtk-object)")
+    return 1
+
+def _write_callable(engine, v, maxDepth):
+    # pylint: disable=unused-argument
+    engine.write("(callable)")
+    return 1
+
+def _open_obj(engine, v, maxDepth):
+    try:
+        d = v.__dict__
+    except AttributeError:
+        return _write_callable(engine, v, maxDepth) if callable(v) else _write_str(engine, v, maxDepth)
+    return engine.open_hash(dict(d), maxDepth, type(v).__name__)
 
-    for k in ordered:
-        v = d[k]
-        (depth, child) = _stringify(v, maxDepth, maxItems, maxStrlen, callingDepth + 1, recursionMap)
+def _write_ndarray(engine, v, maxDepth):
+    # pylint: disable=unused-argument
+    engine.write(ndarray_summary(v, engine.maxItems, engine.maxStrlen))
+    return 1
 
-        if depth > max_inner_depth:
-            max_inner_depth = depth
-        out.append(f"{k}={child}")
+def ndarray_summary(a, maxItems=-1, maxStrlen=-1):
+    """
+    Summarise a numpy array without converting it to a list: its type, shape and dtype,
+    the min, max and mean of numeric arrays (computed by numpy), and the first and last
+    few elements, eg "ndarray{shape=1000x3,dtype=float64,min=0.0,max=1.0,mean=0.5,data=[0.0,0.1,0.2,...(+2994 items),0.9,1.0,1.0]}"
 
-    if len(out) > maxItems:
-        more = len(out) - maxItems
-        out = out[0:maxItems] + [f"...(+{more} items)"]
+    Parameters:
+        a (numpy.ndarray): the array
+        maxItems (int|-1): show this many elements (-1 for 6)
+        maxStrlen (int|-1): if >= 3, then ellipsise the elements if they are longer than this
 
-    if result is None:
-        result = "{" + ",".join(out) + "}"
+    Returns:
+        str: the summary
+    """
+    np = sys.modules["numpy"]
+    size = a.size
+    out = [ "shape=" + ("x".join(str(n) for n in a.shape) or "()"), f"dtype={a.dtype}" ]
+
+    if size and (np.issubdtype(a.dtype, np.integer) or np.issubdtype(a.dtype, np.floating)):
+        out.append(f"min={a.min()}")
+        out.append(f"max={a.max()}")
+        out.append(f"mean={a.mean():.6g}")
+
+    shown = maxItems if maxItems >= 0 else 6
+    flat = a.flat
+    if size <= shown:
+        items = [ str(x) for x in flat[0:size].tolist() ]
+    else:
+        tail = shown // 2
+        head = shown - tail
+        items = [ str(x) for x in flat[0:head].tolist() ]
+        items.append(f"...(+{size - shown} items)")
+        items.extend(str(x) for x in flat[size - tail:size].tolist())
+
+    data = ",".join(items)
+    if 3 <= maxStrlen < len(data):
+        data = data[0:maxStrlen-3] + "..."
+    out.append("data=[" + data + "]")
+    return type(a).__name__ + "{" + ",".join(out) + "}"
+
+def _user_handler(fn):
+    def handler(engine, v, maxDepth):
+        res = fn(v)
+        if isinstance(res, str):
+            engine.write(res)
+            return 1
+        return engine.open(res, maxDepth)
+    return handler
+
+_BASE_HANDLERS = {
+    type(None): _write_none,
+    str: _write_text,
+    int: _write_str,
+    float: _write_str,
+    bool: _write_str,
+}
+
+# functions registered with register_stringifier(), wrapped as handlers
+_stringifiers = {}
+
+# the handler for each type seen so far
+_handlers = dict(_BASE_HANDLERS)
+
+def _has_instance_dict(t):
+    return t.__dictoffset__ != 0 or any('__dict__' in vars(base) for base in t.__mro__)
+
+def _resolve_handler(t):
+    """
+    Find the handler for a type, and remember it for next time.
+    """
+    # pylint: disable=too-many-return-statements
+    handler = None
+    for base in t.__mro__:
+        handler = _stringifiers.get(base)
+        if handler is not None:
+            break
+    if handler is None:
+        r = t.__name__
+        # numpy is never imported here, but if it is in use then its arrays are summarised
+        np = sys.modules.get("numpy")
+        if np is not None and issubclass(t, np.ndarray):
+            handler = _write_ndarray
+        elif np is not None and issubclass(t, np.generic):
+            handler = _write_str
+        elif t in (list, tuple):
+            handler = _Engine.open_array
+        elif t is dict or 'AttrDict' in str(t):
+            handler = _Engine.open_hash
+        elif 'Gtk' in r or 'Gdk' in r or 'Glib' in r:
+            handler = _write_gtk
+        elif issubclass(t, str):
+            handler = _write_text
+        elif _has_instance_dict(t):
+            handler = _open_obj
+        elif any('__call__' in vars(base) for base in t.__mro__):
+            handler = _write_callable
+        else:
+            handler = _write_str
+    _handlers[t] = handler
+    return handler
+
+def register_stringifier(t, fn):
+    """
+    Register a function to convert values of a type (and its subclasses) for stringify().
+
+    The function is called with the value, and returns either the text to show for it,
+    or another value (eg a dict or list) to convert in its place, with the same limits.
+    int, float, str, bool and None values are always converted directly.
+    The results cached by set_stringify_cache() are discarded, as they may use the old conversion.
 
-    return (max_inner_depth + 1, result)
+    Parameters:
+        t (type): the type
+        fn (callable): the function, or None to remove an earlier registration
+    """
+    if fn is None:
+        _stringifiers.pop(t, None)
+    else:
+        _stringifiers[t] = _user_handler(fn)
+    _handlers.clear()
+    _handlers.update(_BASE_HANDLERS)
+    cache = _cache
+    if cache is not None:
+        cache.clear()
 
 
 def dump(item):
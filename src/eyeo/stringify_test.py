@@ -0,0 +1,234 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+__pdoc__ = {
+    'pytest': False
+}
+
+from io import StringIO
+
+import pytest
+
+from eyeo.stringify import *
+from eyeo.stringify import _IMMUTABLE, _CACHEABLE
+from eyeo import stringify_examples
+
+class Node:
+    """ a linked object for testing deep structures """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, child=None):
+        self.child = child
+
+def test_examples():
+    stringify_examples.test_stringify_examples()
+
+def test_stringify_deep_list():
+    v = []
+    for _ in range(20000):
+        v = [v]
+    (depth, text) = stringify(v)
+    assert depth == 20000
+    assert text == "[" * 20001 + "]" * 20001
+
+def test_stringify_deep_objects():
+    v = None
+    for _ in range(5000):
+        v = Node(v)
+    (depth, text) = stringify(v, None, 6)
+    assert depth == 5001
+    assert text.startswith("Node{child=Node{child=")
+    assert text.endswith("child=(None)" + "}" * 5000)
+
+def test_stringify_recursion():
+    v = [1, 2]
+    v.append(v)
+    assert stringify(v) == (2, "[1,2,(recursion)]")
+
+def test_stringify_shared_objects():
+    # the temporary __dict__ copies of sibling objects must not be mistaken for recursion
+    items = [ Node(), Node(), Node() ]
+    assert stringify_value(items, maxItems=6) == "[Node{child=(None)},Node{child=(None)},Node{child=(None)}]"
+
+def test_stringify_array():
+    assert stringify_array([1, "a", None, [2.5, True]]) == (3, "[1,a,(None),[2.5,True]]")
+    assert stringify_array(list(range(10)), maxItems=3) == (2, "[0,1,2,...(+7 items)]")
+    assert stringify_array(list(range(10)), maxStrlen=8) == (2, "[0,1,2...]")
+
+def test_stringify_hash():
+    assert stringify_hash({"b": 2, "a": [1]}, maxItems=6) == (3, "{a=[1],b=2}")
+    assert stringify_hash({"b": 2, "a": 1, "c": 3}, maxItems=1) == (2, "{a=1,...(+2 items)}")
+
+class Counted:
+    """ an object which counts how often it is converted """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ()
+    converted = 0
+    def __str__(self):
+        Counted.converted += 1
+        return "c"
+
+def test_stringify_only_shown_items():
+    Counted.converted = 0
+    v = [ Counted() for _ in range(1000) ]
+    assert stringify_array(v, maxItems=3) == (2, "[c,c,c,...(+997 items)]")
+    assert Counted.converted == 3
+    Counted.converted = 0
+    assert stringify_array(v, maxStrlen=10) == (2, "[c,c,c,c...]")
+    assert Counted.converted < 10
+    Counted.converted = 0
+    assert stringify_hash({ i: Counted() for i in range(1000) }, maxItems=2) == (2, "{0=c,1=c,...(+998 items)}")
+    assert Counted.converted == 2
+
+def test_stringify_huge_list():
+    # cheap to build, and the items beyond the first six would be converted if they were visited
+    Counted.converted = 0
+    v = [ Counted() for _ in range(6) ] + [ Counted() ] * 9999994
+    assert stringify_value(v, 3, 6, 400) == "[c,c,c,c,c,c,...(+9999994 items)]"
+    assert Counted.converted == 6
+
+class Fragments:
+    """ a stream which keeps each write separately """
+    def __init__(self):
+        self.parts = []
+    def write(self, text):
+        self.parts.append(text)
+
+def test_stringify_to():
+    v = { "b": [1, 2, { "c": None }], "a": Node(), "d": list(range(20)) }
+    buf = StringIO()
+    assert stringify_to(buf, v, None, 6, 30) == stringify(v, None, 6, 30)[0]
+    assert buf.getvalue() == stringify_value(v, None, 6, 30)
+    assert buf.getvalue() == "{a=Node{child=(None)},b=[1,2,{c=(None)}],d=[0,1,2,3,4,5,...(+14 items)]}"
+
+def test_stringify_to_fragments():
+    # the text is written as it is produced, not built up and written at the end
+    stream = Fragments()
+    assert stringify_to(stream, [[1, 2], {"a": [3]}], None, 6) == 4
+    assert "".join(stream.parts) == "[[1,2],{a=[3]}]"
+    assert max(len(part) for part in stream.parts) <= 3
+
+class Point:
+    """ a type with a registered stringifier """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class Point3(Point):
+    """ a subclass, which uses the stringifier of Point """
+    # pylint: disable=too-few-public-methods
+
+class Slotted:
+    """ an object without a __dict__ """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('a',)
+    def __call__(self):
+        pass
+
+def test_register_stringifier():
+    register_stringifier(Point, lambda p: f"({p.x},{p.y})")
+    try:
+        assert stringify_value([Point(1, 2), Point3(3, 4)]) == "[(1,2),(3,4)]"
+        register_stringifier(Point3, lambda p: {"x": p.x, "y": p.y})
+        assert stringify([Point3(3, [4])], maxItems=6) == (4, "[{x=3,y=[4]}]")
+    finally:
+        register_stringifier(Point, None)
+        register_stringifier(Point3, None)
+    assert stringify_value(Point(1, 2), maxItems=6) == "Point{x=1,y=2}"
+
+def test_stringify_types():
+    assert stringify_value(Slotted()) == "(callable)"
+    assert stringify_value(len) == "(callable)"
+    assert stringify_value(b"ab") == "b'ab'"
+
+def test_stringify_hash_first_keys():
+    d = { f"k{i:06d}": i for i in range(100000, 0, -1) }
+    assert stringify_hash(d, maxItems=2) == (2, "{k000001=1,k000002=2,...(+99998 items)}")
+
+def test_stringify_hash_mixed_keys():
+    d = { "b": 1, 2: 2, None: 3, "a": 4 }
+    assert stringify_value(d, maxItems=6) == "{None=3,2=2,a=4,b=1}"
+    assert stringify_value(d, maxItems=2) == "{None=3,2=2,...(+2 items)}"
+
+def test_stringify_hash_insertion_order():
+    d = { "b": 1, "c": 2, "a": 3 }
+    assert stringify_value(d, maxItems=6, sortKeys=False) == "{b=1,c=2,a=3}"
+    assert stringify_value(d, maxItems=1, sortKeys=False) == "{b=1,...(+2 items)}"
+    assert stringify_value(d, sortKeys=False) == "{b=1,c=2,...(+4 items)}"
+
+def test_stringify_numpy():
+    np = pytest.importorskip("numpy")
+    a = np.arange(3000.0).reshape(1000, 3)
+    assert stringify(a, 3, 6, 400) == (1, "ndarray{shape=1000x3,dtype=float64,min=0.0,max=2999.0,mean=1499.5,data=[0.0,1.0,2.0,...(+2994 items),2997.0,2998.0,2999.0]}")
+    assert stringify_value([np.arange(4)[::2], np.int32(3)], maxItems=1) == "[ndarray{shape=2,dtype=int64,min=0,max=2,mean=1,data=[0,...(+1 items)]},...(+1 items)]"
+    assert stringify_value(np.array(["a", "bbb"]), maxStrlen=4) == "ndarray{shape=2,dtype=<U3,data=[a...]}"
+
+class Frozen:
+    """ an immutable type, marked as cacheable """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ()
+    converted = 0
+    def __str__(self):
+        Frozen.converted += 1
+        return "frozen"
+
+def test_stringify_cache():
+    set_stringify_cache(100000)
+    try:
+        config = tuple(range(100))
+        assert stringify(config) == stringify(config)
+        stats = stringify_cache_stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+        buf = StringIO()
+        assert stringify_to(buf, config, 3, 6, 400) == 2
+        assert stringify_to(buf, config, 3, 6, 400) == 2
+        assert buf.getvalue() == "[0,1,2,3,4,5,...(+94 items)]" * 2
+        assert stringify_cache_stats()["hits"] == 2
+
+        # a tuple holding a mutable value is not cached, as the value can change
+        mutable = (1, [2])
+        assert stringify_value(mutable) == "[1,[2]]"
+        mutable[1].append(3)
+        assert stringify_value(mutable) == "[1,[2,3]]"
+        assert stringify_cache_stats()["entries"] == 2
+
+        mark_cacheable(Frozen)
+        Frozen.converted = 0
+        value = (Frozen(), "x")
+        assert stringify_value(value) == stringify_value(value) == "[frozen,x]"
+        assert Frozen.converted == 1
+
+        # a new conversion is used for values which were cached with the old one
+        register_stringifier(Frozen, lambda f: "thawed")
+        try:
+            assert stringify_value(value) == "[thawed,x]"
+        finally:
+            register_stringifier(Frozen, None)
+        assert stringify_value(value) == "[frozen,x]"
+    finally:
+        set_stringify_cache(0)
+        _IMMUTABLE.discard(Frozen)
+        _CACHEABLE.discard(Frozen)
+    assert stringify_cache_stats() is None
+
+def test_stringify_cache_eviction():
+    set_stringify_cache(1000)
+    try:
+        values = [ tuple(range(i, i + 50)) for i in range(10) ]
+        for v in values:
+            stringify(v)
+        stats = stringify_cache_stats()
+        assert stats["bytes"] <= 1000
+        assert stats["evictions"] == 10 - stats["entries"]
+        stringify(values[-1])
+        assert stringify_cache_stats()["hits"] == 1
+        stringify(values[0])
+        assert stringify_cache_stats()["hits"] == 1
+        # a value larger than the cache is not kept, even though its text is short
+        big = tuple(range(1000))
+        stringify(big, 3, 6, 400)
+        stringify(big, 3, 6, 400)
+        assert stringify_cache_stats()["hits"] == 1
+    finally:
+        set_stringify_cache(0)
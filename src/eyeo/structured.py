@@ -0,0 +1,188 @@
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+"""
+Structured output: one JSON object (JSON Lines) or one logfmt line per call of the output routines,
+for log indexers which would otherwise have to parse free text.
+
+Each record has the fields:
+    ts:    the time, as UTC ISO 8601 with milliseconds, eg 2024-05-01T12:00:00.123Z
+    level: error, warning, info, verbose or debug (see eyeo.msgx())
+    site:  the call site, "file:line"
+    msg:   the message, as the text output routines would print it (without the level prefix)
+    args:  the arguments, with bool, int, float, str and None values kept as they are, and
+           other values converted with stringify() (in logfmt, as the fields arg0, arg1, ...)
+
+For example:
+
+    output_records("logfmt")
+    warn("retrying", url, 3)
+
+    ts=2024-05-01T12:00:00.123Z level=warning site=fetch.py:42 msg="retrying https://example.com 3" arg0=https://example.com arg1=3
+
+The encoded levels, sites and field names are cached, so a record costs little more than its message.
+"""
+
+import time
+import math
+
+from json.encoder import encode_basestring
+
+from eyeo.sinks import Sink
+from eyeo.stringify import stringify_value
+
+RECORD_FORMATS = ( "jsonl", "logfmt" )
+
+class _Cache:
+    """ Scoping class for the cached parts of records """
+    # pylint: disable=too-few-public-methods
+    # the current second, and its ISO 8601 text
+    second = None
+    second_text = ""
+    # str -> its encoding, for levels and sites
+    json_strings = {}
+    logfmt_values = {}
+    logfmt_arg_keys = [ f" arg{i}=" for i in range(16) ]
+    limit = 1024
+
+def timestamp(now=None):
+    """
+    Return the time (by default, the current time) as UTC ISO 8601 with milliseconds.
+    The text of the date and time up to the second is reused within each second.
+    """
+    if now is None:
+        now = time.time()
+    second = int(now)
+    if second != _Cache.second:
+        _Cache.second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        _Cache.second = second
+    return f"{_Cache.second_text}.{int((now - second) * 1000):03d}Z"
+
+def _cached(cache, text, encode):
+    found = cache.get(text)
+    if found is None:
+        found = encode(text)
+        if len(cache) >= _Cache.limit:
+            cache.clear()
+        cache[text] = found
+    return found
+
+def _json_value(v):
+    t = type(v)
+    if t is str:
+        return encode_basestring(v)
+    if v is None:
+        return "null"
+    if t is bool:
+        return "true" if v else "false"
+    if t is int:
+        return int.__repr__(v)
+    if t is float:
+        if math.isfinite(v):
+            return float.__repr__(v)
+        return encode_basestring(float.__repr__(v))
+    return encode_basestring(stringify_value(v, 3, 6, 400))
+
+def encode_jsonl(level, site, message, args, now=None):
+    """
+    Return a record as a line of JSON.
+
+    Parameters:
+        level (str): the level
+        site (str): the call site
+        message (str): the message text
+        args (tuple|list): the arguments
+        now (float): the time, by default the current time
+
+    Returns:
+        str: the line, including its line feed
+    """
+    strings = _Cache.json_strings
+    return "".join((
+        '{"ts":"', timestamp(now),
+        '","level":', _cached(strings, level, encode_basestring),
+        ',"site":', _cached(strings, site, encode_basestring),
+        ',"msg":', encode_basestring(message),
+        ',"args":[', ",".join([ _json_value(v) for v in args ]), "]}\n"))
+
+def _logfmt_text(text):
+    if not text:
+        return '""'
+    if ' ' in text or '=' in text or '"' in text or '\\' in text or not text.isprintable():
+        return encode_basestring(text)
+    return text
+
+def _logfmt_value(v):
+    t = type(v)
+    if t is str:
+        return _logfmt_text(v)
+    if v is None:
+        return "null"
+    if t is bool:
+        return "true" if v else "false"
+    if t is int:
+        return int.__repr__(v)
+    if t is float:
+        return float.__repr__(v)
+    return _logfmt_text(stringify_value(v, 3, 6, 400))
+
+def encode_logfmt(level, site, message, args, now=None):
+    """
+    Return a record as a logfmt line, see encode_jsonl().
+    Values which contain spaces, quotes, '=' or control characters are quoted (with JSON escapes).
+    """
+    values = _Cache.logfmt_values
+    parts = [ "ts=", timestamp(now),
+              " level=", _cached(values, level, _logfmt_text),
+              " site=", _cached(values, site, _logfmt_text),
+              " msg=", _logfmt_text(message) ]
+    keys = _Cache.logfmt_arg_keys
+    for i, v in enumerate(args):
+        if i >= len(keys):
+            keys.append(f" arg{i}=")
+        parts.append(keys[i])
+        parts.append(_logfmt_value(v))
+    parts.append("\n")
+    return "".join(parts)
+
+ENCODERS = { "jsonl": encode_jsonl, "logfmt": encode_logfmt }
+
+class RecordSink(Sink):
+    """
+    A sink which writes a structured record (see RECORD_FORMATS) for each call of the output routines.
+    The output routines pass the level, call site and arguments to emit() rather than formatting a line.
+    Text written by other means (eg pretty_to(), or output_pop(print_to_upper=True)) becomes the
+    message of a record with no arguments.
+
+    Parameters:
+        fhandle (file): the destination
+        fmt (str): one of "jsonl" or "logfmt"
+    """
+    records = True
+
+    def __init__(self, fhandle, fmt="jsonl"):
+        if fmt not in ENCODERS:
+            raise ValueError(f"Unknown record format '{fmt}', expected one of {RECORD_FORMATS}")
+        self.fhandle = fhandle
+        self.fmt = fmt
+        self.encode = ENCODERS[fmt]
+
+    def emit(self, level, site, message, args):
+        """
+        Write a record.
+
+        Parameters:
+            see encode_jsonl()
+        """
+        self.fhandle.write(self.encode(level, site, message, args))
+
+    def write(self, text):
+        message = text.rstrip("\n")
+        if message:
+            self.emit("info", "", message, ())
+        return len(text)
+
+    def flush(self):
+        self.fhandle.flush()
+
+    def isatty(self):
+        return self.fhandle.isatty()
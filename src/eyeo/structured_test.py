@@ -0,0 +1,76 @@
+#!/bin/env python3
+# pylint: disable=missing-function-docstring,unused-wildcard-import,line-too-long,trailing-newlines,missing-module-docstring,wildcard-import,invalid-name
+
+__pdoc__ = {
+    'pytest': False
+}
+
+import json
+from io import StringIO
+
+import pytest
+
+from eyeo import eo, msg, warn, err, info, verb, set_verbose, output_records, output_pop, current_line_number
+from eyeo.structured import *
+
+NOW = 1714564800.1234   # 2024-05-01T12:00:00.123Z
+
+def test_timestamp():
+    assert timestamp(NOW) == "2024-05-01T12:00:00.123Z"
+    assert timestamp(NOW + 61.5) == "2024-05-01T12:01:01.623Z"
+
+def test_encode_jsonl():
+    line = encode_jsonl("warning", "app.py:12", 'retry "x"', ["x", 3, 2.5, None, True, float("nan"), [1, 2]], now=NOW)
+    assert line.endswith("}\n")
+    assert json.loads(line) == {
+        "ts": "2024-05-01T12:00:00.123Z", "level": "warning", "site": "app.py:12", "msg": 'retry "x"',
+        "args": ["x", 3, 2.5, None, True, "nan", "[1,2]"] }
+
+def test_encode_logfmt():
+    line = encode_logfmt("info", "app.py:12", "two words", ["plain", "a=b", "", 'q"uote', "line\nfeed", 7, {"k": 1}], now=NOW)
+    assert line == ('ts=2024-05-01T12:00:00.123Z level=info site=app.py:12 msg="two words" '
+                    'arg0=plain arg1="a=b" arg2="" arg3="q\\"uote" arg4="line\\nfeed" arg5=7 arg6="{k=1}"\n')
+
+def test_record_sink():
+    with pytest.raises(ValueError):
+        RecordSink(StringIO(), "xml")
+    buf = StringIO()
+    sink = RecordSink(buf, "jsonl")
+    sink.write("plain text\n")
+    sink.write("\n")
+    record = json.loads(buf.getvalue())
+    assert (record["level"], record["site"], record["msg"], record["args"]) == ("info", "", "plain text", [])
+
+def test_output_records():
+    buf = StringIO()
+    output_records("jsonl", buf)
+    try:
+        line = current_line_number() + 1
+        warn("retrying", "host", 3)
+        err("failed", [1, 2])
+        info("started")
+        msg("plain", None)
+        set_verbose(1)
+        verb("detail", 1.5)
+        eo("done {} of {}", 2, 3)
+    finally:
+        set_verbose(0)
+        output_pop()
+    records = [ json.loads(text) for text in buf.getvalue().splitlines() ]
+    assert [ (r["level"], r["msg"], r["args"]) for r in records ] == [
+        ("warning", "retrying host 3", ["retrying", "host", 3]),
+        ("error", "failed [1,2]", ["failed", "[1,2]"]),
+        ("info", "started", ["started"]),
+        ("info", "plain None", ["plain", None]),
+        ("verbose", "detail 1.5", ["detail", 1.5]),
+        ("info", "done 2 of 3", [2, 3]),
+    ]
+    assert records[0]["site"] == f"structured_test.py:{line}"
+
+def test_record_style():
+    buf = StringIO()
+    msg("count", 3, style="logfmt", file=buf)
+    eo("count", 4, style="jsonl", file=buf)
+    lines = buf.getvalue().splitlines()
+    assert lines[0].endswith(" level=info site=structured_test.py:" + str(current_line_number() - 3) + ' msg="count 3" arg0=count arg1=3')
+    assert json.loads(lines[1])["args"] == ["count", 4]